@@ -0,0 +1,49 @@
+from typing import List, Optional, Tuple
+
+from sqlalchemy import Row, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud
+import models
+
+# Асинхронные версии функций чтения из crud.py для сессий из
+# database.get_async_db. Запись идет только через crud.py: блокировки и
+# агрегаты (rollups) там
+
+# --- Пользователи ---
+
+
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[models.User]:
+    result = await db.scalars(select(models.User).where(models.User.email == email))
+    return result.first()
+
+
+async def get_user_token_version(db: AsyncSession, user_id: int) -> Optional[int]:
+    return await db.scalar(
+        select(models.User.token_version).where(models.User.id == user_id)
+    )
+
+
+async def get_data_version(db: AsyncSession, user_id: int) -> Optional[int]:
+    return await db.scalar(
+        select(models.User.data_version).where(models.User.id == user_id)
+    )
+
+
+# --- Задачи ---
+
+
+async def get_tasks_page(
+    db: AsyncSession, owner_id: int, limit: int, cursor: Optional[str] = None, **filters
+) -> Tuple[List[models.Task], Optional[str]]:
+    stmt = crud.tasks_page_query(owner_id, limit, cursor, **filters)
+    result = await db.scalars(stmt)
+    return crud.split_page(list(result), limit)
+
+
+async def get_task_rows_page(
+    db: AsyncSession, owner_id: int, limit: int, cursor: Optional[str] = None, **filters
+) -> Tuple[List[Row], Optional[str]]:
+    stmt = crud.tasks_page_query(owner_id, limit, cursor, **filters)
+    result = await db.execute(stmt.with_only_columns(*crud.TASK_OUT_COLUMNS))
+    return crud.split_page(result.all(), limit)
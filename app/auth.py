@@ -1,22 +1,33 @@
 import os
+import threading
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+import async_crud
 import crud
 import database
+import hashing
+from user_cache import CachedUser, user_cache
 
 # --- Конфигурация безопасности ---
 SECRET_KEY = os.getenv("SECRET_KEY", "your_secret_key_here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+# Пока все выданные токены не истекли, принимаем и старые токены только с email
+LEGACY_EMAIL_TOKENS = os.getenv("LEGACY_EMAIL_TOKENS", "1") == "1"
+# Как долго эпоха пользователя считается актуальной без перечитывания из БД
+TOKEN_EPOCH_TTL_SECONDS = int(os.getenv("TOKEN_EPOCH_TTL_SECONDS", 60))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = hashing.pwd_context
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
@@ -29,16 +40,34 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+# Асинхронные варианты считают bcrypt в пуле процессов и не занимают event loop
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await hashing.hashing_service.verify(plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await hashing.hashing_service.hash(password)
+
+
 # --- Аутентификация пользователя ---
 def authenticate_user(db: Session, email: str, password: str):
     user = crud.get_user_by_email(db, email)
-    if not user:
+    if not user or user.deleted_at is not None:
         return False
     if not verify_password(password, user.hashed_password):
         return False
     return user
 
 
+async def authenticate_user_async(db: Session, email: str, password: str):
+    user = await run_in_threadpool(crud.get_user_by_email, db, email)
+    if not user or user.deleted_at is not None:
+        return False
+    if not await verify_password_async(password, user.hashed_password):
+        return False
+    return user
+
+
 # --- Создание JWT токена ---
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -50,23 +79,116 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-# --- Получение текущего пользователя из токена ---
-async def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)
-):
-    credentials_exception = HTTPException(
+# Токен с id пользователя и версией (эпохой) его токенов
+def create_user_token(user, expires_delta: Optional[timedelta] = None) -> str:
+    return create_access_token(
+        data={"sub": user.email, "uid": user.id, "ver": user.token_version},
+        expires_delta=expires_delta,
+    )
+
+
+# --- Таблица эпох токенов ---
+# uid -> (версия токенов, время загрузки). Токен с версией меньше текущей отозван.
+class TokenEpochs:
+    def __init__(self, ttl: int = TOKEN_EPOCH_TTL_SECONDS):
+        self.ttl = ttl
+        self._epochs: Dict[int, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    async def get(self, db: AsyncSession, user_id: int) -> Optional[int]:
+        entry = self._epochs.get(user_id)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        version = await async_crud.get_user_token_version(db, user_id)
+        if version is None:
+            self.forget(user_id)
+            return None
+        self.set(user_id, version)
+        return version
+
+    def set(self, user_id: int, version: int) -> None:
+        with self._lock:
+            self._epochs[user_id] = (version, time.monotonic())
+
+    def forget(self, user_id: int) -> None:
+        with self._lock:
+            self._epochs.pop(user_id, None)
+
+
+token_epochs = TokenEpochs()
+
+
+# Отзыв всех выданных пользователю токенов (например, при смене пароля)
+def revoke_user_tokens(db: Session, user) -> None:
+    user.token_version += 1
+    db.commit()
+    token_epochs.set(user.id, user.token_version)
+    user_cache.invalidate(user.email)
+
+
+@dataclass(frozen=True)
+class Principal:
+    id: int
+
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+async def _decode_token(token: str, db: AsyncSession) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str | None = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
-    user = crud.get_user_by_email(db, email=email)
-    if user is None:
-        raise credentials_exception
-    return user
+        raise _credentials_exception()
+    if payload.get("sub") is None:
+        raise _credentials_exception()
+    if "uid" in payload:
+        version = await token_epochs.get(db, payload["uid"])
+        if version is None or payload.get("ver") != version:
+            raise _credentials_exception()
+    elif not LEGACY_EMAIL_TOKENS:
+        raise _credentials_exception()
+    return payload
+
+
+async def _resolve_user(payload: dict, db: AsyncSession) -> CachedUser:
+    email = payload["sub"]
+    cached = user_cache.get(email)
+    if cached is not None:
+        return cached
+    # Удаленный аккаунт в кэш не попадает: при удалении запись сбрасывается,
+    # а старые токены без uid не проходят проверку эпохи и ловятся здесь
+    user = await async_crud.get_user_by_email(db, email)
+    if user is None or user.deleted_at is not None:
+        raise _credentials_exception()
+    cached = CachedUser(id=user.id, email=user.email, created_at=user.created_at)
+    user_cache.set(email, cached, payload.get("exp"))
+    return cached
+
+
+# Сессия закрывается сразу после функции эндпоинта, а не после отправки
+# ответа: иначе каждый поток (SSE, NDJSON) держал бы соединение до конца
+_async_db = Depends(database.get_async_db, scope="function")
+
+
+# --- Получение текущего пользователя из токена ---
+# Пользователь берется из кэша по sub токена, в БД идем только при промахе.
+# Запросы идут через асинхронную сессию и не блокируют event loop
+async def get_current_user(
+    token: str = Depends(oauth2_scheme), db: AsyncSession = _async_db
+) -> CachedUser:
+    return await _resolve_user(await _decode_token(token, db), db)
+
+
+# Для эндпоинтов, которым нужен только id: без запроса к users
+async def get_current_principal(
+    token: str = Depends(oauth2_scheme), db: AsyncSession = _async_db
+) -> Principal:
+    payload = await _decode_token(token, db)
+    if "uid" in payload:
+        return Principal(id=payload["uid"])
+    return Principal(id=(await _resolve_user(payload, db)).id)
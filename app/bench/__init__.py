@@ -0,0 +1,5 @@
+import os
+
+# Бенчмарки запускаются из папки app: python -m bench.<имя>
+# По умолчанию используют отдельную SQLite-базу, чтобы не трогать рабочую
+os.environ.setdefault("DATABASE_URL", "sqlite:///./bench.db")
@@ -0,0 +1,376 @@
+import argparse
+import asyncio
+import json
+import re
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+from sqlalchemy import select
+
+import auth
+import database
+import models
+import ratelimit
+from bench.common import Timer, create_schema, seed_projects, seed_users, summarize
+from main import app
+
+# Нагрузочный тест API: все эндпоинты main.py через асинхронный httpx-клиент
+# внутри процесса (ASGITransport). Для каждого сценария - задержки p50/p95/p99,
+# запросов в секунду и SQL-запросов на запрос (из заголовка Server-Timing).
+# Результаты пишутся в JSON; --baseline сравнивает с предыдущим прогоном.
+# PostgreSQL: DATABASE_URL=postgresql://... python -m bench.api
+# GET /events не входит: это бесконечный поток, ASGITransport его не отдает.
+
+PASSWORD = "bench-password"
+# Весь трафик идет с одного адреса: ограничение частоты измерялось бы вместо API
+ratelimit.limiter.enabled = False
+_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+class Fixture:
+    def __init__(self, args):
+        self.run_id = uuid.uuid4().hex[:8]
+        self.user_ids = seed_users(args.users, args.tasks // args.users)
+        self.projects = seed_projects(
+            self.user_ids, args.projects_per_user, args.tasks_per_project
+        )
+        with database.SessionLocal() as db:
+            users = db.scalars(
+                select(models.User).where(models.User.id.in_(self.user_ids))
+            ).all()
+            self.headers = {
+                user.id: {"Authorization": f"Bearer {auth.create_user_token(user)}"}
+                for user in users
+            }
+            self.task_ids = {
+                user_id: db.scalars(
+                    select(models.Task.id)
+                    .where(models.Task.owner_id == user_id)
+                    .order_by(models.Task.id)
+                    .limit(100)
+                ).all()
+                for user_id in self.user_ids
+            }
+        # Идентификаторы, созданные одними сценариями и удаляемые другими
+        self.created: Dict[str, List] = defaultdict(list)
+        self.timer_locks = {user_id: asyncio.Lock() for user_id in self.user_ids}
+
+    def user(self, i: int) -> int:
+        return self.user_ids[i % len(self.user_ids)]
+
+    def email(self, i: int) -> str:
+        return f"api-{self.run_id}-{i}@bench.example.com"
+
+
+Call = Callable[[httpx.AsyncClient, Fixture, int], Awaitable[httpx.Response]]
+
+
+# --- Сценарии: (имя, функция запроса, ограничение числа запросов) ---
+
+
+async def register(client, fx, i):
+    return await client.post(
+        "/register", json={"email": fx.email(i), "password": PASSWORD}
+    )
+
+
+async def login(client, fx, i):
+    data = {"username": fx.email(i % len(fx.created["emails"])), "password": PASSWORD}
+    return await client.post("/token", data=data)
+
+
+async def users_me(client, fx, i):
+    return await client.get("/users/me", headers=fx.headers[fx.user(i)])
+
+
+async def create_task(client, fx, i):
+    user_id = fx.user(i)
+    response = await client.post(
+        "/task/create",
+        json={"title": f"API task {i}", "description": "bench", "time_spent": i % 90},
+        headers=fx.headers[user_id],
+    )
+    if response.status_code == 201:
+        fx.created["tasks"].append((user_id, response.json()["id"]))
+    return response
+
+
+async def list_tasks(client, fx, i):
+    return await client.get(
+        "/tasks/", params={"limit": 100}, headers=fx.headers[fx.user(i)]
+    )
+
+
+async def list_tasks_conditional(client, fx, i):
+    headers = fx.headers[fx.user(i)]
+    first = await client.get("/tasks/", params={"limit": 100}, headers=headers)
+    etag = {"If-None-Match": first.headers.get("ETag", "")}
+    return await client.get(
+        "/tasks/", params={"limit": 100}, headers={**headers, **etag}
+    )
+
+
+async def stream_tasks(client, fx, i):
+    return await client.get(
+        "/tasks/", params={"stream": True}, headers=fx.headers[fx.user(i)]
+    )
+
+
+async def search_tasks(client, fx, i):
+    return await client.get(
+        "/tasks/search",
+        params={"q": f"Task {i % 100}", "limit": 50},
+        headers=fx.headers[fx.user(i)],
+    )
+
+
+async def bulk_create(client, fx, i):
+    user_id = fx.user(i)
+    items = [{"title": f"Bulk {i}-{n}", "time_spent": n} for n in range(20)]
+    response = await client.post("/tasks/bulk", json=items, headers=fx.headers[user_id])
+    if response.status_code == 201:
+        fx.created["bulk"].append((user_id, response.json()["ids"]))
+    return response
+
+
+async def bulk_update(client, fx, i):
+    user_id = fx.user(i)
+    ids = fx.task_ids[user_id][:50]
+    status = ("pending", "in_progress", "done")[i % 3]
+    return await client.patch(
+        "/tasks/bulk", json={"ids": ids, "status": status}, headers=fx.headers[user_id]
+    )
+
+
+async def timer_start_stop(client, fx, i):
+    user_id = fx.user(i)
+    task_id = fx.task_ids[user_id][i % len(fx.task_ids[user_id])]
+    # Один таймер на пользователя: пары запросов одного пользователя по очереди
+    async with fx.timer_locks[user_id]:
+        await client.post(f"/tasks/{task_id}/start", headers=fx.headers[user_id])
+        return await client.post(f"/tasks/{task_id}/stop", headers=fx.headers[user_id])
+
+
+async def current_timer(client, fx, i):
+    return await client.get("/timer/current", headers=fx.headers[fx.user(i)])
+
+
+async def time_entries(client, fx, i):
+    user_id = fx.user(i)
+    task_id = fx.task_ids[user_id][0]
+    return await client.get(
+        f"/tasks/{task_id}/time_entries", headers=fx.headers[user_id]
+    )
+
+
+async def create_project(client, fx, i):
+    user_id = fx.user(i)
+    response = await client.post(
+        "/projects/",
+        json={"name": f"api-{fx.run_id}-{i}", "task_ids": []},
+        headers=fx.headers[user_id],
+    )
+    if response.status_code == 201:
+        fx.created["projects"].append((user_id, response.json()["id"]))
+    return response
+
+
+async def list_projects(client, fx, i):
+    return await client.get("/projects/", headers=fx.headers[fx.user(i)])
+
+
+async def read_project(client, fx, i):
+    user_id = fx.user(i)
+    project_ids = fx.projects[user_id]
+    return await client.get(
+        f"/projects/{project_ids[i % len(project_ids)]}", headers=fx.headers[user_id]
+    )
+
+
+async def select_tasks(client, fx, i):
+    user_id = fx.user(i)
+    project_ids = fx.projects[user_id]
+    return await client.get(
+        f"/projects/{project_ids[i % len(project_ids)]}/select_tasks",
+        params={"time_limit": 600, "strategy": ("greedy", "exact")[i % 2]},
+        headers=fx.headers[user_id],
+    )
+
+
+async def time_report(client, fx, i):
+    group_by = ("project", "status", "day", "week", "month")[i % 5]
+    return await client.get(
+        "/reports/time", params={"group_by": group_by}, headers=fx.headers[fx.user(i)]
+    )
+
+
+async def delete_project(client, fx, i):
+    user_id, project_id = fx.created["projects"].pop()
+    return await client.delete(f"/projects/{project_id}", headers=fx.headers[user_id])
+
+
+async def delete_task(client, fx, i):
+    user_id, task_id = fx.created["tasks"].pop()
+    return await client.delete(f"/tasks/{task_id}", headers=fx.headers[user_id])
+
+
+async def delete_tasks_bulk(client, fx, i):
+    user_id, ids = fx.created["bulk"].pop()
+    return await client.delete(
+        "/tasks/", params={"ids": ids}, headers=fx.headers[user_id]
+    )
+
+
+async def metrics(client, fx, i):
+    return await client.get("/metrics")
+
+
+async def delete_me(client, fx, i):
+    data = {"username": fx.created["emails"].pop(), "password": PASSWORD}
+    return await client.request("DELETE", "/delete/me", data=data)
+
+
+# Порядок важен: сценарии удаления используют созданное предыдущими.
+# Лимит - для дорогих по CPU (bcrypt) и расходующих созданные объекты сценариев
+SCENARIOS = [
+    ("POST /register", register, "auth"),
+    ("POST /token", login, "auth"),
+    ("GET /users/me", users_me, None),
+    ("POST /task/create", create_task, None),
+    ("GET /tasks/", list_tasks, None),
+    ("GET /tasks/ If-None-Match", list_tasks_conditional, None),
+    ("GET /tasks/?stream", stream_tasks, "stream"),
+    ("GET /tasks/search", search_tasks, None),
+    ("POST /tasks/bulk", bulk_create, None),
+    ("PATCH /tasks/bulk", bulk_update, None),
+    ("POST /tasks/{id}/start+stop", timer_start_stop, None),
+    ("GET /timer/current", current_timer, None),
+    ("GET /tasks/{id}/time_entries", time_entries, None),
+    ("POST /projects/", create_project, None),
+    ("GET /projects/", list_projects, None),
+    ("GET /projects/{id}", read_project, None),
+    ("GET /projects/{id}/select_tasks", select_tasks, None),
+    ("GET /reports/time", time_report, None),
+    ("DELETE /projects/{id}", delete_project, "projects"),
+    ("DELETE /tasks/{id}", delete_task, "tasks"),
+    ("DELETE /tasks/?ids=", delete_tasks_bulk, "bulk"),
+    ("GET /metrics", metrics, None),
+    ("DELETE /delete/me", delete_me, "emails"),
+]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, fx: Fixture, name: str, call: Call, count: int, args
+) -> Dict:
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: List[float] = []
+    queries: List[int] = []
+    statuses: Counter = Counter()
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            response = await call(client, fx, i)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+            match = _QUERIES.search(response.headers.get("Server-Timing", ""))
+            if match:
+                queries.append(int(match.group(1)))
+
+    with Timer() as timer:
+        await asyncio.gather(*(one(i) for i in range(count)))
+    result = summarize(name, latencies, timer.elapsed)
+    result["queries_per_request"] = round(sum(queries) / max(len(queries), 1), 2)
+    result["statuses"] = {str(code): n for code, n in sorted(statuses.items())}
+    result["errors"] = sum(n for code, n in statuses.items() if code >= 400)
+    return result
+
+
+def scenario_count(limit, fx: Fixture, args) -> int:
+    if limit == "auth":
+        return args.auth_requests
+    if limit == "stream":
+        return max(1, args.requests // 10)
+    if limit is None:
+        return args.requests
+    # Удаление - ровно столько, сколько создано
+    return len(fx.created[limit])
+
+
+async def run(args) -> List[Dict]:
+    fx = Fixture(args)
+    transport = httpx.ASGITransport(app=app)
+    results = []
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        for name, call, limit in SCENARIOS:
+            if args.only and not any(part in name for part in args.only):
+                continue
+            if name == "POST /token" and not fx.created["emails"]:
+                continue
+            count = scenario_count(limit, fx, args)
+            if count == 0:
+                continue
+            result = await run_scenario(client, fx, name, call, count, args)
+            if name == "POST /register":
+                fx.created["emails"] = [fx.email(i) for i in range(count)]
+            results.append(result)
+            print(
+                f"{name:34} rps={result['rps']:>8} p50={result['p50_ms']:>8} "
+                f"p95={result['p95_ms']:>8} p99={result['p99_ms']:>8} "
+                f"q/req={result['queries_per_request']:>6} errors={result['errors']}"
+            )
+    return results
+
+
+def compare(results: List[Dict], baseline_path: str) -> None:
+    with open(baseline_path) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    print(f"\nvs {baseline_path}:")
+    for result in results:
+        old = baseline.get(result["name"])
+        if old is None:
+            continue
+        p95 = (result["p95_ms"] - old["p95_ms"]) / max(old["p95_ms"], 1e-9) * 100
+        rps = (result["rps"] - old["rps"]) / max(old["rps"], 1e-9) * 100
+        print(f"{result['name']:34} p95 {p95:+7.1f}%  rps {rps:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API load test")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--tasks", type=int, default=10000, help="всего задач")
+    parser.add_argument("--projects-per-user", type=int, default=5)
+    parser.add_argument("--tasks-per-project", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=500, help="на сценарий")
+    parser.add_argument("--auth-requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--only", nargs="*", help="подстроки имен сценариев")
+    parser.add_argument("--output", default="bench_api.json")
+    parser.add_argument("--baseline", help="JSON предыдущего прогона")
+    args = parser.parse_args()
+
+    create_schema()
+    results = asyncio.run(run(args))
+    report = {
+        "meta": {
+            "started_at": datetime.utcnow().isoformat(),
+            "database": database.engine.dialect.name,
+            **{key: value for key, value in vars(args).items() if key != "baseline"},
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved to {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import async_crud
+import crud
+import database
+from bench.common import BENCH_EMAIL, Timer, create_schema, seed_users, summarize
+
+# Нагрузочный тест: одинаковая работа "запроса" (поиск пользователя + страница
+# задач) через синхронную сессию в пуле потоков, как у sync-эндпоинтов
+# Starlette, и через асинхронную сессию в event loop.
+
+
+def sync_request(email: str) -> float:
+    start = time.perf_counter()
+    with database.SessionLocal() as db:
+        user = crud.get_user_by_email(db, email)
+        crud.get_tasks_page(db, user.id, 100)
+    return time.perf_counter() - start
+
+
+def run_sync(emails, threads: int):
+    with ThreadPoolExecutor(max_workers=threads) as pool, Timer() as timer:
+        latencies = list(pool.map(sync_request, emails))
+    return summarize(f"sync threads={threads}", latencies, timer.elapsed)
+
+
+async def run_async(emails, concurrency: int):
+    session_factory = database.get_async_sessionmaker()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request(email: str) -> float:
+        async with semaphore:
+            start = time.perf_counter()
+            async with session_factory() as db:
+                user = await async_crud.get_user_by_email(db, email)
+                await async_crud.get_tasks_page(db, user.id, 100)
+            return time.perf_counter() - start
+
+    with Timer() as timer:
+        latencies = await asyncio.gather(*(request(email) for email in emails))
+    await database.async_engine.dispose()
+    return summarize(f"async concurrency={concurrency}", latencies, timer.elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync vs async DB throughput")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--tasks-per-user", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+
+    create_schema()
+    seed_users(args.users, args.tasks_per_user)
+    emails = [BENCH_EMAIL.format(i % args.users) for i in range(args.requests)]
+
+    results = [
+        run_sync(emails, args.threads),
+        asyncio.run(run_async(emails, args.concurrency)),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import delete, insert, select, update
+
+import database
+import models
+import rollups
+
+BENCH_EMAIL = "bench-{}@bench.example.com"
+
+
+def create_schema() -> None:
+    config = Config(os.path.join(os.path.dirname(__file__), "..", "alembic.ini"))
+    command.upgrade(config, "head")
+
+
+# Быстрое наполнение базы напрямую через INSERT, минуя API
+def seed_users(count: int, tasks_per_user: int) -> List[int]:
+    now = datetime.utcnow()
+    user_ids = []
+    with database.engine.begin() as conn:
+        conn.execute(
+            delete(models.User).where(
+                models.User.email.like("bench-%@bench.example.com")
+            )
+        )
+        for i in range(count):
+            user_id = conn.execute(
+                insert(models.User)
+                .values(email=BENCH_EMAIL.format(i), hashed_password="!")
+                .returning(models.User.id)
+            ).scalar_one()
+            user_ids.append(user_id)
+            rows = [
+                {
+                    "title": f"Task {n}",
+                    "description": "Seeded by benchmark",
+                    "status": "pending",
+                    "created_at": now + timedelta(seconds=n),
+                    "time_spent": n % 240,
+                    "owner_id": user_id,
+                }
+                for n in range(tasks_per_user)
+            ]
+            for start in range(0, len(rows), 5000):
+                conn.execute(insert(models.Task), rows[start : start + 5000])
+    return user_ids
+
+
+# Проекты пользователей: первые задачи пользователя делятся между проектами
+def seed_projects(
+    user_ids: List[int], per_user: int, tasks_per_project: int
+) -> Dict[int, List[int]]:
+    projects: Dict[int, List[int]] = {}
+    with database.engine.begin() as conn:
+        for user_id in user_ids:
+            projects[user_id] = []
+            task_ids = conn.scalars(
+                select(models.Task.id)
+                .where(models.Task.owner_id == user_id)
+                .order_by(models.Task.id)
+                .limit(per_user * tasks_per_project)
+            ).all()
+            for n in range(per_user):
+                project_id = conn.execute(
+                    insert(models.Project)
+                    .values(name=f"bench-{user_id}-{n}", owner_id=user_id)
+                    .returning(models.Project.id)
+                ).scalar_one()
+                chunk = task_ids[n * tasks_per_project : (n + 1) * tasks_per_project]
+                conn.execute(
+                    update(models.Task)
+                    .where(models.Task.id.in_(chunk))
+                    .values(project_id=project_id)
+                )
+                projects[user_id].append(project_id)
+    # Агрегаты для отчетов по засеянным напрямую задачам
+    with database.SessionLocal() as db:
+        for user_id in user_ids:
+            rollups.rebuild(db, user_id)
+        db.commit()
+    return projects
+
+
+def summarize(name: str, latencies: List[float], elapsed: float) -> Dict:
+    ordered = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+
+    return {
+        "name": name,
+        "requests": len(ordered),
+        "rps": round(len(ordered) / elapsed, 1),
+        "p50_ms": round(percentile(0.50), 2),
+        "p95_ms": round(percentile(0.95), 2),
+        "p99_ms": round(percentile(0.99), 2),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 2),
+    }
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
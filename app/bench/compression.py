@@ -0,0 +1,117 @@
+import argparse
+import gzip
+import json
+from typing import Callable, Dict, List
+
+import compression
+import crud
+import database
+import serialization
+from bench.common import Timer, create_schema, seed_users
+
+# Байты на проводе против CPU для каждой кодировки и уровня на реальных ответах:
+# страница GET /tasks/ и выгрузка NDJSON (сжимается по строке, как в middleware).
+# total_ms - сжатие плюс передача по каналу --link-mbit: на быстром канале
+# высокие уровни не окупаются.
+
+LEVELS = {
+    "gzip": [1, 3, 6, 9],
+    "br": [0, 1, 4, 6, 9, 11],
+    "zstd": [1, 3, 6, 12, 19],
+}
+
+
+def _encoder(encoding: str, level: int):
+    if encoding == "gzip":
+        return compression.GzipEncoder(level)
+    if encoding == "br":
+        return compression.BrotliEncoder(level)
+    return compression.ZstdEncoder(level)
+
+
+def _decompressor(encoding: str) -> Callable[[bytes], bytes]:
+    if encoding == "gzip":
+        return gzip.decompress
+    if encoding == "br":
+        return compression.brotli.decompress
+    return _zstd_decompress
+
+
+# Поток без размера в заголовке кадра: decompress() для него не подходит
+def _zstd_decompress(data: bytes) -> bytes:
+    return compression.zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+def encode(encoding: str, level: int, chunks: List[bytes]) -> bytes:
+    encoder = _encoder(encoding, level)
+    out = [encoder.compress(chunk) for chunk in chunks]
+    out.append(encoder.finish())
+    return b"".join(out)
+
+
+def best_of(repeat: int, func, *args) -> float:
+    timings = []
+    for _ in range(repeat):
+        with Timer() as timer:
+            func(*args)
+        timings.append(timer.elapsed)
+    return min(timings) * 1000
+
+
+def payloads(owner_id: int, page_size: int) -> Dict[str, List[bytes]]:
+    with database.SessionLocal() as db:
+        page = crud.filter_tasks(owner_id).limit(page_size)
+        rows = db.execute(page.with_only_columns(*crud.TASK_OUT_COLUMNS)).all()
+        body = serialization.ORJSONResponse(serialization.rows_to_dicts(rows)).body
+        stream = list(serialization.ndjson_lines(crud.iter_task_rows(db, owner_id)))
+    return {f"GET /tasks/?limit={page_size}": [body], "GET /tasks/?stream": stream}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response compression levels")
+    parser.add_argument("--tasks", type=int, default=20000)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--link-mbit", type=float, default=50.0)
+    args = parser.parse_args()
+
+    create_schema()
+    (owner_id,) = seed_users(1, args.tasks)
+
+    def transfer(size: int) -> float:
+        return size * 8 / (args.link_mbit * 1e6) * 1000
+
+    results = []
+    for name, chunks in payloads(owner_id, args.page_size).items():
+        raw = sum(len(chunk) for chunk in chunks)
+        results.append(
+            {
+                "payload": name,
+                "encoding": "identity",
+                "bytes": raw,
+                "total_ms": round(transfer(raw), 2),
+            }
+        )
+        for encoding in compression.ENCODERS:
+            for level in LEVELS[encoding]:
+                body = encode(encoding, level, chunks)
+                assert _decompressor(encoding)(body) == b"".join(chunks)
+                compress_ms = best_of(args.repeat, encode, encoding, level, chunks)
+                decompress_ms = best_of(args.repeat, _decompressor(encoding), body)
+                results.append(
+                    {
+                        "payload": name,
+                        "encoding": encoding,
+                        "level": level,
+                        "bytes": len(body),
+                        "ratio": round(raw / len(body), 2),
+                        "compress_ms": round(compress_ms, 2),
+                        "decompress_ms": round(decompress_ms, 2),
+                        "total_ms": round(compress_ms + transfer(len(body)), 2),
+                    }
+                )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
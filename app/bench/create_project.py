@@ -0,0 +1,56 @@
+import argparse
+import json
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event, select
+
+import auth
+import database
+import models
+from bench.common import Timer, create_schema, seed_users
+from main import app
+
+# Время и число SQL-запросов POST /projects/ в зависимости от размера проекта
+
+
+def main():
+    parser = argparse.ArgumentParser(description="POST /projects/ scaling")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    args = parser.parse_args()
+
+    create_schema()
+    (user_id,) = seed_users(1, max(args.sizes))
+    with database.SessionLocal() as db:
+        user = db.get(models.User, user_id)
+        headers = {"Authorization": f"Bearer {auth.create_user_token(user)}"}
+        task_ids = list(
+            db.scalars(select(models.Task.id).where(models.Task.owner_id == user_id))
+        )
+
+    statements = []
+    event.listen(
+        database.engine,
+        "before_cursor_execute",
+        lambda *args: statements.append(args[2]),
+    )
+    client = TestClient(app)
+    results = []
+    for size in args.sizes:
+        payload = {"name": f"Bench project {size}", "task_ids": task_ids[:size]}
+        statements.clear()
+        with Timer() as timer:
+            response = client.post("/projects/", json=payload, headers=headers)
+        assert response.status_code == 201, response.text
+        results.append(
+            {
+                "tasks": size,
+                "ms": round(timer.elapsed * 1000, 2),
+                "queries": len(statements),
+            }
+        )
+        client.delete(f"/projects/{response.json()['id']}", headers=headers)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
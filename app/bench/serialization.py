@@ -0,0 +1,68 @@
+import argparse
+import json
+from typing import List
+
+from pydantic import TypeAdapter
+
+import crud
+import database
+import schemas
+import serialization
+from bench.common import Timer, create_schema, seed_users
+
+# Выборка + сериализация списка задач: ORM-объекты через TaskOut (как при
+# response_model) против строк по колонкам через orjson
+
+
+def pydantic_path(db, owner_id: int, size: int, adapter: TypeAdapter) -> bytes:
+    stmt = crud.filter_tasks(owner_id).limit(size)
+    tasks = list(db.scalars(stmt))
+    return adapter.dump_json(adapter.validate_python(tasks, from_attributes=True))
+
+
+def orjson_path(db, owner_id: int, size: int) -> bytes:
+    stmt = crud.filter_tasks(owner_id).limit(size)
+    rows = db.execute(stmt.with_only_columns(*crud.TASK_OUT_COLUMNS)).all()
+    return serialization.ORJSONResponse(serialization.rows_to_dicts(rows)).body
+
+
+def best_of(repeat: int, func, *args) -> float:
+    timings = []
+    for _ in range(repeat):
+        with database.SessionLocal() as db:
+            with Timer() as timer:
+                func(db, *args)
+        timings.append(timer.elapsed)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Task list serialization")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    create_schema()
+    (owner_id,) = seed_users(1, max(args.sizes))
+    adapter = TypeAdapter(List[schemas.TaskOut])
+
+    results = []
+    for size in args.sizes:
+        with database.SessionLocal() as db:
+            expected = json.loads(pydantic_path(db, owner_id, size, adapter))
+            assert json.loads(orjson_path(db, owner_id, size)) == expected
+        pydantic_ms = best_of(args.repeat, pydantic_path, owner_id, size, adapter)
+        orjson_ms = best_of(args.repeat, orjson_path, owner_id, size)
+        results.append(
+            {
+                "tasks": size,
+                "pydantic_ms": round(pydantic_ms, 2),
+                "orjson_ms": round(orjson_ms, 2),
+                "speedup": round(pydantic_ms / orjson_ms, 2),
+            }
+        )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
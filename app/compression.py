@@ -0,0 +1,207 @@
+import os
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# brotli и zstandard необязательны: без них доступен только gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# --- Конфигурация сжатия ---
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "1") == "1"
+# Ответ меньше порога отдается как есть: заголовки и CPU дороже выигрыша
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+# Уровни подобраны по bench/compression.py: дальше рост CPU больше выигрыша в байтах
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 4))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", 3))
+# Поток событий должен доходить до клиента сразу, его не сжимаем
+SKIP_MEDIA_TYPES = ("text/event-stream",)
+
+
+# --- Потоковые кодировщики ---
+# compress() может вернуть пустую строку: данные копятся внутри кодировщика
+# и уходят блоками, finish() отдает остаток
+class GzipEncoder:
+    def __init__(self, level: int = COMPRESSION_GZIP_LEVEL):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    def __init__(self, quality: int = COMPRESSION_BROTLI_QUALITY):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdEncoder:
+    def __init__(self, level: int = COMPRESSION_ZSTD_LEVEL):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+# Порядок - предпочтение сервера при одинаковом q
+ENCODERS: Dict[str, type] = {}
+if zstandard is not None:
+    ENCODERS["zstd"] = ZstdEncoder
+if brotli is not None:
+    ENCODERS["br"] = BrotliEncoder
+ENCODERS["gzip"] = GzipEncoder
+
+
+# Выбор кодировки по Accept-Encoding с учетом q-значений
+def negotiate(accept_encoding: str) -> Optional[str]:
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    candidates: List[Tuple[float, int, str]] = []
+    for order, name in enumerate(ENCODERS):
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > 0:
+            candidates.append((-q, order, name))
+    return min(candidates)[2] if candidates else None
+
+
+def _add_vary(headers: MutableHeaders) -> None:
+    vary = headers.get("vary")
+    if vary is None:
+        headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        headers["Vary"] = f"{vary}, Accept-Encoding"
+
+
+# --- ASGI middleware ---
+# Чистый ASGI, а не BaseHTTPMiddleware: потоковые ответы (NDJSON) сжимаются
+# по мере генерации без накопления тела в памяти. Ответ меньше
+# COMPRESSION_MIN_SIZE не сжимается; у потока размер заранее неизвестен,
+# поэтому он сжимается всегда.
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # На HEAD тела нет, а Content-Length должен совпадать с ответом на GET
+        if (
+            scope["type"] != "http"
+            or scope["method"] == "HEAD"
+            or not COMPRESSION_ENABLED
+        ):
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressedResponder(encoding, self.minimum_size, send).run(
+            self.app, scope, receive
+        )
+
+
+class _CompressedResponder:
+    def __init__(self, encoding: str, minimum_size: int, send: Send):
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send = send
+        self.start: Optional[Message] = None
+        self.encoder = None
+        # None - решение еще не принято, False - ответ идет без сжатия
+        self.compress: Optional[bool] = None
+        # Размер несжатого тела; None - поток неизвестной длины
+        self.size: Optional[int] = None
+        self.buffer: List[bytes] = []
+
+    async def run(self, app: ASGIApp, scope: Scope, receive: Receive) -> None:
+        await app(scope, receive, self.wrapped_send)
+
+    async def wrapped_send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start = message
+            headers = Headers(raw=message["headers"])
+            media_type = headers.get("content-type", "").split(";")[0].strip()
+            if (
+                "content-encoding" in headers
+                or media_type in SKIP_MEDIA_TYPES
+                or message["status"] in (204, 304)
+            ):
+                self.compress = False
+                await self.send(message)
+            return
+        if message["type"] != "http.response.body" or self.compress is False:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compress is None:
+            headers = MutableHeaders(raw=self.start["headers"])
+            _add_vary(headers)
+            # BaseHTTPMiddleware отдает и обычный ответ частями, поэтому размер
+            # берется из Content-Length, а не из первой части тела
+            length = headers.get("content-length")
+            if length is not None:
+                self.size = int(length)
+            elif not more_body:
+                self.size = len(body)
+            if self.size is not None and self.size < self.minimum_size:
+                self.compress = False
+                await self.send(self.start)
+                await self.send(message)
+                return
+            self.compress = True
+            self.encoder = ENCODERS[self.encoding]()
+            headers["Content-Encoding"] = self.encoding
+            del headers["Content-Length"]
+            if self.size is None:
+                await self.send(self.start)
+
+        if self.size is not None:
+            # Тело известной длины сжимается целиком, чтобы отдать Content-Length
+            self.buffer.append(body)
+            if more_body:
+                return
+            body = self.encoder.compress(b"".join(self.buffer)) + self.encoder.finish()
+            headers = MutableHeaders(raw=self.start["headers"])
+            headers["Content-Length"] = str(len(body))
+            await self.send(self.start)
+            await self.send({"type": "http.response.body", "body": body})
+            return
+
+        chunk = self.encoder.compress(body)
+        if not more_body:
+            chunk += self.encoder.finish()
+        if chunk or not more_body:
+            await self.send(
+                {"type": "http.response.body", "body": chunk, "more_body": more_body}
+            )
@@ -1,8 +1,16 @@
-from typing import List, Optional
+import base64
+import json
+from datetime import datetime
+from typing import Iterator, List, Optional, Set, Tuple
 
-from sqlalchemy.orm import Session
+from sqlalchemy import Row, Select, and_, delete, func, insert, or_, select, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session, load_only, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 
+import events
 import models
+import rollups
 import schemas
 
 # --- Пользователи ---
@@ -12,42 +20,241 @@ def get_user_by_email(db: Session, email: str) -> Optional[models.User]:
     return db.query(models.User).filter(models.User.email == email).first()
 
 
+def get_user_token_version(db: Session, user_id: int) -> Optional[int]:
+    return (
+        db.query(models.User.token_version).filter(models.User.id == user_id).scalar()
+    )
+
+
+# Запись одной командой INSERT ... RETURNING: объект сразу содержит все
+# колонки, повторное чтение после commit не нужно
 def create_user(
     db: Session, user_in: schemas.UserCreate, hashed_password: str
 ) -> models.User:
-    db_user = models.User(email=user_in.email, hashed_password=hashed_password)
-    db.add(db_user)
+    db_user = db.scalars(
+        insert(models.User).returning(models.User),
+        [{"email": user_in.email, "hashed_password": hashed_password}],
+    ).one()
     db.commit()
-    db.refresh(db_user)
     return db_user
 
 
+# Задачи, проекты и журнал времени удаляет БД (ON DELETE CASCADE)
+def delete_user(db: Session, user: models.User) -> None:
+    db.execute(delete(models.User).where(models.User.id == user.id))
+    db.commit()
+
+
+# Проверка порога без подсчета всех задач пользователя
+def has_more_tasks_than(db: Session, user_id: int, count: int) -> bool:
+    stmt = (
+        select(models.Task.id)
+        .where(models.Task.owner_id == user_id)
+        .offset(count)
+        .limit(1)
+    )
+    return db.scalar(stmt) is not None
+
+
+# Версия данных пользователя меняется в той же транзакции, что и его задачи
+# и проекты, поэтому по ней можно отвечать 304 без чтения самих данных.
+# Новая версия служит id события в ленте изменений (events.py)
+def get_data_version(db: Session, user_id: int) -> Optional[int]:
+    return db.scalar(select(models.User.data_version).where(models.User.id == user_id))
+
+
+def record_change(db: Session, user_id: int, event_type: str, data: dict) -> int:
+    version = db.scalar(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(data_version=models.User.data_version + 1)
+        .returning(models.User.data_version)
+        .execution_options(synchronize_session=False)
+    )
+    events.emit(db, events.ChangeEvent(version, user_id, event_type, data))
+    return version
+
+
+# Поля задачи в событии; описание не передается, чтобы уложиться в лимит NOTIFY
+def task_event_data(task) -> dict:
+    return {
+        "id": task.id,
+        "title": task.title,
+        "status": task.status,
+        "time_spent": task.time_spent,
+        "project_id": task.project_id,
+    }
+
+
 # --- Задачи ---
 
+# Колонки задачи, которые попадают в TaskOut
+TASK_OUT_COLUMNS = (
+    models.Task.id,
+    models.Task.title,
+    models.Task.description,
+    models.Task.time_spent,
+    models.Task.status,
+    models.Task.created_at,
+    models.Task.owner_id,
+)
+
 
 def create_task(db: Session, task_in: schemas.TaskCreate, owner_id: int) -> models.Task:
-    db_task = models.Task(
-        title=task_in.title,
-        description=task_in.description,
-        owner_id=owner_id,
-        status="pending",
-    )
-    db.add(db_task)
+    db_task = db.scalars(
+        insert(models.Task).returning(models.Task), [task_row(task_in, owner_id)]
+    ).one()
+    rollups.add_task(db, db_task)
+    record_change(db, owner_id, "task.created", task_event_data(db_task))
     db.commit()
-    db.refresh(db_task)
     return db_task
 
 
-def get_tasks(
-    db: Session, owner_id: int, skip: int = 0, limit: int = 100
-) -> List[models.Task]:
-    return (
-        db.query(models.Task)
-        .filter(models.Task.owner_id == owner_id)
-        .offset(skip)
-        .limit(limit)
-        .all()
+# --- Массовые операции с задачами ---
+
+
+def task_row(task_in: schemas.TaskCreate, owner_id: int) -> dict:
+    return {
+        "title": task_in.title,
+        "description": task_in.description,
+        "time_spent": task_in.time_spent,
+        "owner_id": owner_id,
+        "status": "pending",
+        "created_at": datetime.utcnow(),
+    }
+
+
+# Одна многострочная вставка INSERT ... VALUES (...), (...) RETURNING id.
+# sort_by_parameter_order на SQLite превращается в INSERT на каждую строку,
+# поэтому порядок восстанавливается сортировкой: id одной вставки выдаются
+# подряд в порядке строк VALUES
+def insert_tasks(db: Session, rows: List[dict]) -> List[int]:
+    stmt = insert(models.Task).returning(models.Task.id)
+    ids = sorted(db.scalars(stmt, rows))
+    rollups.add_tasks(db, models.Task.id.in_(ids))
+    return ids
+
+
+# Вставка пачки в savepoint; если пачка не прошла, строки вставляются по
+# одной, чтобы вернуть ошибку только для конкретных элементов
+def insert_tasks_isolated(
+    db: Session, rows: List[dict]
+) -> Tuple[List[int], List[Tuple[int, str]]]:
+    try:
+        with db.begin_nested():
+            return insert_tasks(db, rows), []
+    except DBAPIError:
+        pass
+    ids, failures = [], []
+    for position, row in enumerate(rows):
+        try:
+            with db.begin_nested():
+                ids.extend(insert_tasks(db, [row]))
+        except DBAPIError as e:
+            failures.append((position, str(e.orig)))
+    return ids, failures
+
+
+def update_tasks(db: Session, owner_id: int, ids: List[int], values: dict) -> int:
+    where = (models.Task.id.in_(ids), models.Task.owner_id == owner_id)
+    rollups.remove_tasks(db, *where)
+    result = db.execute(
+        update(models.Task)
+        .where(*where)
+        .values(**values)
+        .execution_options(synchronize_session=False)
     )
+    rollups.add_tasks(db, *where)
+    return result.rowcount
+
+
+# Курсор - непрозрачная для клиента строка с ключом последней строки страницы
+def pack_cursor(values: list) -> str:
+    raw = json.dumps(values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def unpack_cursor(cursor: str) -> list:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded))
+
+
+def encode_cursor(created_at: datetime, task_id: int) -> str:
+    return pack_cursor([created_at.isoformat(), task_id])
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    created_at, task_id = unpack_cursor(cursor)
+    return datetime.fromisoformat(created_at), int(task_id)
+
+
+# Построители запросов общие для синхронного и асинхронного слоя
+def filter_tasks(
+    owner_id: int,
+    status: Optional[str] = None,
+    project_id: Optional[int] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+) -> Select:
+    stmt = select(models.Task).where(models.Task.owner_id == owner_id)
+    if status is not None:
+        stmt = stmt.where(models.Task.status == status)
+    if project_id is not None:
+        stmt = stmt.where(models.Task.project_id == project_id)
+    if created_from is not None:
+        stmt = stmt.where(models.Task.created_at >= created_from)
+    if created_to is not None:
+        stmt = stmt.where(models.Task.created_at < created_to)
+    return stmt.order_by(models.Task.created_at, models.Task.id)
+
+
+# Keyset-пагинация по (created_at, id): страница начинается строго после курсора
+def tasks_page_query(
+    owner_id: int, limit: int, cursor: Optional[str] = None, **filters
+) -> Select:
+    stmt = filter_tasks(owner_id, **filters)
+    if cursor is not None:
+        created_at, task_id = decode_cursor(cursor)
+        stmt = stmt.where(
+            or_(
+                models.Task.created_at > created_at,
+                and_(models.Task.created_at == created_at, models.Task.id > task_id),
+            )
+        )
+    return stmt.limit(limit + 1)
+
+
+def split_page(
+    tasks: List[models.Task], limit: int
+) -> Tuple[List[models.Task], Optional[str]]:
+    if len(tasks) <= limit:
+        return tasks, None
+    tasks = tasks[:limit]
+    return tasks, encode_cursor(tasks[-1].created_at, tasks[-1].id)
+
+
+def get_tasks_page(
+    db: Session, owner_id: int, limit: int, cursor: Optional[str] = None, **filters
+) -> Tuple[List[models.Task], Optional[str]]:
+    stmt = tasks_page_query(owner_id, limit, cursor, **filters)
+    return split_page(list(db.scalars(stmt)), limit)
+
+
+# Страница задач в виде строк с колонками TaskOut, без создания ORM-объектов
+def get_task_rows_page(
+    db: Session, owner_id: int, limit: int, cursor: Optional[str] = None, **filters
+) -> Tuple[List[Row], Optional[str]]:
+    stmt = tasks_page_query(owner_id, limit, cursor, **filters)
+    rows = db.execute(stmt.with_only_columns(*TASK_OUT_COLUMNS)).all()
+    return split_page(rows, limit)
+
+
+# Потоковая выборка: строки читаются пачками, в памяти держится только одна пачка
+def iter_task_rows(
+    db: Session, owner_id: int, batch_size: int = 1000, **filters
+) -> Iterator[Row]:
+    stmt = filter_tasks(owner_id, **filters).with_only_columns(*TASK_OUT_COLUMNS)
+    return db.execute(stmt.execution_options(yield_per=batch_size))
 
 
 def get_task(db: Session, task_id: int, owner_id: int) -> Optional[models.Task]:
@@ -58,16 +265,254 @@ def get_task(db: Session, task_id: int, owner_id: int) -> Optional[models.Task]:
     )
 
 
-def update_task(
-    db: Session, task: models.Task, task_in: schemas.TaskUpdate
-) -> models.Task:
-    for field, value in task_in.dict(exclude_unset=True).items():
-        setattr(task, field, value)
+# Удаление задач одной командой: RETURNING отдает поля для агрегатов, а
+# проекты, оставшиеся без задач, удаляются в той же транзакции
+def delete_tasks(
+    db: Session, owner_id: int, ids: List[int]
+) -> Tuple[List[int], List[int]]:
+    rows = db.execute(
+        delete(models.Task)
+        .where(models.Task.id.in_(ids), models.Task.owner_id == owner_id)
+        .returning(
+            models.Task.id,
+            models.Task.owner_id,
+            models.Task.project_id,
+            models.Task.status,
+            models.Task.created_at,
+            models.Task.time_spent,
+        )
+        .execution_options(synchronize_session=False)
+    ).all()
+    rollups.remove_rows(db, rows)
+    project_ids = {row.project_id for row in rows if row.project_id}
+    return [row.id for row in rows], delete_orphan_projects(db, project_ids)
+
+
+# Проверка и удаление в одном DELETE, без отдельного COUNT между ними.
+# Проекты сначала блокируются: иначе при READ COMMITTED задача, привязанная
+# к проекту параллельной транзакцией после снимка NOT EXISTS, не спасет его
+# от удаления. Привязка берет на проект FOR KEY SHARE и ждет этой блокировки
+def delete_orphan_projects(db: Session, project_ids: Set[int]) -> List[int]:
+    if not project_ids:
+        return []
+    db.execute(
+        select(models.Project.id)
+        .where(models.Project.id.in_(project_ids))
+        .order_by(models.Project.id)
+        .with_for_update()
+    )
+    has_tasks = select(models.Task.id).where(
+        models.Task.project_id == models.Project.id
+    )
+    return list(
+        db.scalars(
+            delete(models.Project)
+            .where(models.Project.id.in_(project_ids), ~has_tasks.exists())
+            .returning(models.Project.id)
+            .execution_options(synchronize_session=False)
+        )
+    )
+
+
+# --- Учет времени ---
+
+
+def get_running_entry(db: Session, owner_id: int) -> Optional[models.TimeEntry]:
+    return (
+        db.query(models.TimeEntry)
+        .filter(
+            models.TimeEntry.owner_id == owner_id,
+            models.TimeEntry.stopped_at.is_(None),
+        )
+        .first()
+    )
+
+
+def start_timer(db: Session, task_id: int, owner_id: int) -> models.TimeEntry:
+    entry = models.TimeEntry(
+        task_id=task_id, owner_id=owner_id, started_at=datetime.utcnow()
+    )
+    db.add(entry)
     db.commit()
-    db.refresh(task)
-    return task
+    return entry
+
 
+# Остановка без чтения-изменения-записи: запись закрывает только один из
+# конкурирующих запросов, а время задачи увеличивается атомарно в БД
+def stop_timer(db: Session, task_id: int, owner_id: int) -> Optional[models.TimeEntry]:
+    now = datetime.utcnow()
+    stopped = db.execute(
+        update(models.TimeEntry)
+        .where(
+            models.TimeEntry.task_id == task_id,
+            models.TimeEntry.owner_id == owner_id,
+            models.TimeEntry.stopped_at.is_(None),
+        )
+        .values(stopped_at=now)
+        .returning(models.TimeEntry.id, models.TimeEntry.started_at)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if stopped is None:
+        return None
 
-def delete_task(db: Session, task: models.Task) -> None:
-    db.delete(task)
+    minutes = int((now - stopped.started_at).total_seconds() + 30) // 60
+    db.execute(
+        update(models.TimeEntry)
+        .where(models.TimeEntry.id == stopped.id)
+        .values(duration=minutes)
+        .execution_options(synchronize_session=False)
+    )
+    task = db.execute(
+        update(models.Task)
+        .where(models.Task.id == task_id)
+        .values(time_spent=models.Task.time_spent + minutes)
+        .returning(
+            models.Task.owner_id,
+            models.Task.project_id,
+            models.Task.status,
+            models.Task.created_at,
+            models.Task.time_spent,
+        )
+        .execution_options(synchronize_session=False)
+    ).first()
+    rollups.add_task_time(db, task, minutes)
+    record_change(
+        db, owner_id, "task.updated", {"id": task_id, "time_spent": task.time_spent}
+    )
     db.commit()
+    return models.TimeEntry(
+        id=stopped.id,
+        task_id=task_id,
+        owner_id=owner_id,
+        started_at=stopped.started_at,
+        stopped_at=now,
+        duration=minutes,
+    )
+
+
+def get_time_entries(db: Session, task_id: int) -> List[models.TimeEntry]:
+    return (
+        db.query(models.TimeEntry)
+        .filter(models.TimeEntry.task_id == task_id)
+        .order_by(models.TimeEntry.started_at, models.TimeEntry.id)
+        .all()
+    )
+
+
+# --- Проекты ---
+
+
+# Задачи проектов подгружаются одним запросом на всю выборку (selectinload),
+# а без задач читаются только поля самого проекта
+def projects_query(db: Session, owner_id: int, include_tasks: bool = True):
+    query = db.query(models.Project).filter(models.Project.owner_id == owner_id)
+    if include_tasks:
+        return query.options(
+            selectinload(models.Project.tasks).load_only(*TASK_OUT_COLUMNS)
+        )
+    return query.options(load_only(models.Project.id, models.Project.name))
+
+
+def list_projects(
+    db: Session, owner_id: int, include_tasks: bool = True
+) -> List[models.Project]:
+    return projects_query(db, owner_id, include_tasks).order_by(models.Project.id).all()
+
+
+def get_project_with_tasks(
+    db: Session, project_id: int, owner_id: int, include_tasks: bool = True
+) -> Optional[models.Project]:
+    return (
+        projects_query(db, owner_id, include_tasks)
+        .filter(models.Project.id == project_id)
+        .first()
+    )
+
+
+# Заполняет project.tasks уже известными задачами без отложенной загрузки
+def set_project_tasks(db: Session, project: models.Project, task_ids: List[int]):
+    tasks = []
+    if task_ids:
+        tasks = list(
+            db.scalars(
+                select(models.Task)
+                .options(load_only(*TASK_OUT_COLUMNS))
+                .where(models.Task.id.in_(task_ids))
+                .order_by(models.Task.id)
+            )
+        )
+    set_committed_value(project, "tasks", tasks)
+
+
+def get_project(
+    db: Session, project_id: int, owner_id: int
+) -> Optional[models.Project]:
+    return (
+        db.query(models.Project)
+        .filter(models.Project.id == project_id, models.Project.owner_id == owner_id)
+        .first()
+    )
+
+
+# id задач пользователя из списка; строки блокируются до конца транзакции,
+# чтобы их не удалили между проверкой и привязкой к проекту
+def lock_owned_task_ids(db: Session, task_ids: List[int], owner_id: int) -> Set[int]:
+    if not task_ids:
+        return set()
+    stmt = (
+        select(models.Task.id)
+        .where(models.Task.id.in_(task_ids), models.Task.owner_id == owner_id)
+        .with_for_update()
+    )
+    return set(db.scalars(stmt))
+
+
+def assign_tasks_to_project(db: Session, task_ids: List[int], project_id: int) -> None:
+    if task_ids:
+        where = models.Task.id.in_(task_ids)
+        rollups.remove_tasks(db, where)
+        db.execute(
+            update(models.Task)
+            .where(where)
+            .values(project_id=project_id)
+            .execution_options(synchronize_session=False)
+        )
+        rollups.add_tasks(db, where)
+
+
+def detach_project_tasks(db: Session, project_id: int) -> None:
+    rollups.detach_project(db, project_id)
+    db.execute(
+        update(models.Task)
+        .where(models.Task.project_id == project_id)
+        .values(project_id=None)
+        .execution_options(synchronize_session=False)
+    )
+
+
+# Жадный подбор на стороне БД: накопленная сумма по задачам, отсортированным
+# по времени, обрезается лимитом. Клиенту уходят только выбранные строки и
+# только колонки ProjectAlgOut.
+def select_tasks_running_sum(db: Session, project_id: int, time_limit: int):
+    running_total = (
+        func.sum(models.Task.time_spent)
+        .over(order_by=(models.Task.time_spent, models.Task.id))
+        .label("running_total")
+    )
+    ranked = (
+        select(
+            models.Task.id,
+            models.Task.title,
+            models.Task.description,
+            models.Task.time_spent,
+            running_total,
+        )
+        .where(models.Task.project_id == project_id)
+        .subquery()
+    )
+    stmt = (
+        select(ranked.c.id, ranked.c.title, ranked.c.description, ranked.c.time_spent)
+        .where(ranked.c.running_total <= time_limit)
+        .order_by(ranked.c.time_spent, ranked.c.id)
+    )
+    return db.execute(stmt).all()
@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ratelimit import limiter
+from user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+# --- Конфигурация ---
+# Сколько SQL-запросов допустимо на один HTTP-запрос
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", 20))
+# Сколько раз подряд может повториться один и тот же запрос (признак N+1)
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", 5))
+# В тестах превышение бюджета - ошибка, в проде - предупреждение в лог
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "0") == "1"
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+# Статистика одного HTTP-запроса. Объект общий для event loop и пула потоков:
+# contextvars копируются в поток вместе со ссылкой на него.
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+        self.shapes: Counter = Counter()
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("db_stats", default=None)
+
+
+# Время старта хранится в контексте выполнения самого запроса, а не в
+# соединении: запрос с ошибкой не оставляет следов на соединении из пула
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._db_metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = context._db_metrics_start
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.duration += time.perf_counter() - started
+        # Параметры передаются отдельно, поэтому текст запроса и есть его "форма"
+        stats.shapes[statement] += 1
+
+
+def install(engine: Engine) -> None:
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def check_budget(stats: RequestStats, route: str) -> None:
+    problems = []
+    if stats.queries > QUERY_BUDGET:
+        problems.append(f"{stats.queries} queries (budget {QUERY_BUDGET})")
+    for shape, count in stats.shapes.items():
+        if count >= N_PLUS_ONE_THRESHOLD:
+            problems.append(f"statement repeated {count} times: {shape[:200]}")
+    if not problems:
+        return
+    message = f"{route}: " + "; ".join(problems)
+    if QUERY_BUDGET_STRICT:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+# --- Метрики в формате Prometheus ---
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.queries: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.db_seconds: Dict[Tuple[str, str], float] = defaultdict(float)
+
+    def observe(self, method: str, route: str, stats: RequestStats) -> None:
+        key = (method, route)
+        with self._lock:
+            self.requests[key] += 1
+            self.queries[key] += stats.queries
+            self.db_seconds[key] += stats.duration
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, kind, values in (
+                ("http_requests_total", "counter", self.requests),
+                ("db_queries_total", "counter", self.queries),
+                ("db_query_seconds_total", "counter", self.db_seconds),
+            ):
+                lines.append(f"# TYPE {name} {kind}")
+                for (method, route), value in sorted(values.items()):
+                    lines.append(f'{name}{{method="{method}",route="{route}"}} {value}')
+        cache = user_cache.stats()
+        lines.append("# TYPE user_cache_hits_total counter")
+        lines.append(f"user_cache_hits_total {cache['hits']}")
+        lines.append("# TYPE user_cache_misses_total counter")
+        lines.append(f"user_cache_misses_total {cache['misses']}")
+        lines.append("# TYPE rate_limit_rejected_total counter")
+        lines.append(f"rate_limit_rejected_total {limiter.rejected}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# Middleware: считает запросы к БД, отдает их в Server-Timing и метриках.
+# Для потоковых ответов учитываются только запросы до отправки заголовков.
+async def query_stats_middleware(request: Request, call_next):
+    stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        response = await call_next(request)
+    finally:
+        _current.reset(token)
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.observe(request.method, route, stats)
+    response.headers["Server-Timing"] = (
+        f'db;dur={stats.duration * 1000:.1f};desc="{stats.queries} queries"'
+    )
+    check_budget(stats, f"{request.method} {route}")
+    return response
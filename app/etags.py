@@ -0,0 +1,46 @@
+import hashlib
+
+from fastapi import HTTPException, Request, status
+
+# --- Условные GET ---
+# Слабый ETag строится из того, от чего зависит ответ (версия данных
+# пользователя, путь и параметры запроса). При совпадении с If-None-Match
+# отвечаем 304 до выборки и сериализации данных.
+
+
+def weak_etag(*parts) -> str:
+    raw = "|".join(str(part) for part in parts).encode()
+    return f'W/"{hashlib.blake2b(raw, digest_size=8).hexdigest()}"'
+
+
+# Слабое сравнение (RFC 9110): префикс W/ не учитывается
+def matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+def check_not_modified(request: Request, etag: str) -> None:
+    if matches(request, etag):
+        raise HTTPException(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+        )
+
+
+# --- Заголовки кэширования для чтения ---
+# Ответы зависят от пользователя, поэтому общие кэши их не хранят (private).
+# С ETag клиент может хранить ответ, но перед использованием проверяет его
+# условным GET (no-cache); без ETag ответ не сохраняется (no-store).
+async def cache_headers_middleware(request: Request, call_next):
+    response = await call_next(request)
+    if request.method in ("GET", "HEAD") and "cache-control" not in response.headers:
+        if "etag" in response.headers:
+            response.headers["Cache-Control"] = "private, no-cache"
+        else:
+            response.headers["Cache-Control"] = "private, no-store"
+        response.headers["Vary"] = "Authorization"
+    return response
@@ -0,0 +1,252 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass, field
+from typing import AsyncIterator, Deque, Dict, List, Optional, Set
+
+from sqlalchemy import event as sa_event
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# --- Конфигурация ленты изменений ---
+# Сколько последних событий пользователя хранится для продолжения после переподключения
+EVENTS_BUFFER_SIZE = int(os.getenv("EVENTS_BUFFER_SIZE", 100))
+# Для скольких пользователей хранится буфер (LRU)
+EVENTS_BUFFER_USERS = int(os.getenv("EVENTS_BUFFER_USERS", 10000))
+# Очередь одного подключения; медленный клиент отключается и продолжает по Last-Event-ID
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", 100))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", 15))
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", 3000))
+# На PostgreSQL события рассылаются всем воркерам через LISTEN/NOTIFY
+EVENTS_PG_NOTIFY = os.getenv("EVENTS_PG_NOTIFY", "1") == "1"
+EVENTS_CHANNEL = "task_events"
+
+
+# id события - версия данных пользователя (users.data_version) после изменения,
+# поэтому id событий одного пользователя идут подряд без пропусков
+@dataclass(frozen=True)
+class ChangeEvent:
+    id: int
+    user_id: int
+    type: str
+    data: dict = field(default_factory=dict)
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), default=str)
+
+    @classmethod
+    def from_json(cls, payload: str) -> "ChangeEvent":
+        return cls(**json.loads(payload))
+
+    def format(self) -> str:
+        data = json.dumps(self.data, default=str)
+        return f"id: {self.id}\nevent: {self.type}\ndata: {data}\n\n"
+
+
+# Подключение клиента: очередь живет в event loop, в котором оно создано
+class Subscription:
+    def __init__(self, user_id: int, loop: asyncio.AbstractEventLoop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue: "asyncio.Queue[Optional[ChangeEvent]]" = asyncio.Queue(
+            maxsize=EVENTS_QUEUE_SIZE
+        )
+
+    def deliver(self, event: ChangeEvent) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Клиент не успевает читать: закрываем поток, он переподключится
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+# --- Брокер в памяти процесса ---
+# publish можно вызывать из любого потока: события передаются в event loop
+# подписчика через call_soon_threadsafe
+class EventBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self._recent: "OrderedDict[int, Deque[ChangeEvent]]" = OrderedDict()
+        # События, пришедшие раньше предыдущих: user_id -> {id: событие}
+        self._held: Dict[int, Dict[int, ChangeEvent]] = {}
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(user_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    # Подписчики получают события пользователя строго по порядку id.
+    # Без NOTIFY события публикуют после commit потоки пула в произвольном
+    # порядке, поэтому событие с пропуском перед ним ждет недостающих. Пропуск
+    # здесь временный: версия и событие пишутся в одной транзакции. Если он
+    # так и не заполнился, события отдаются как есть, а продолжение по
+    # Last-Event-ID получит reset. Отсчет начинается с первого события
+    # пользователя, которое увидел процесс
+    def _ready(self, event: ChangeEvent) -> List[ChangeEvent]:
+        recent = self._recent.get(event.user_id)
+        last_id = recent[-1].id if recent else None
+        if last_id is not None and event.id <= last_id:
+            return []
+        held = self._held.setdefault(event.user_id, {})
+        held[event.id] = event
+        next_id = min(held) if last_id is None else last_id + 1
+        ready = []
+        while next_id in held:
+            ready.append(held.pop(next_id))
+            next_id += 1
+        if len(held) > EVENTS_BUFFER_SIZE:
+            ready.extend(held.pop(event_id) for event_id in sorted(held))
+        if not held:
+            del self._held[event.user_id]
+        return ready
+
+    def _remember(self, event: ChangeEvent) -> None:
+        recent = self._recent.get(event.user_id)
+        if recent is None:
+            recent = self._recent[event.user_id] = deque(maxlen=EVENTS_BUFFER_SIZE)
+        recent.append(event)
+        self._recent.move_to_end(event.user_id)
+        while len(self._recent) > EVENTS_BUFFER_USERS:
+            user_id, _ = self._recent.popitem(last=False)
+            self._held.pop(user_id, None)
+
+    def publish(self, event: ChangeEvent) -> None:
+        closed = []
+        # Передача в event loop тоже под блокировкой: иначе два потока могли
+        # бы поставить свои события в очередь подписчика в обратном порядке
+        with self._lock:
+            for ready in self._ready(event):
+                self._remember(ready)
+                for subscription in self._subscribers.get(ready.user_id, ()):
+                    try:
+                        subscription.loop.call_soon_threadsafe(
+                            subscription.deliver, ready
+                        )
+                    except RuntimeError:
+                        # event loop уже закрыт
+                        closed.append(subscription)
+        for subscription in closed:
+            self.unsubscribe(subscription)
+
+    # События после after_id; None - буфер уже не содержит всех пропущенных событий
+    def replay(
+        self, user_id: int, after_id: int, current_id: int
+    ) -> Optional[List[ChangeEvent]]:
+        if after_id >= current_id:
+            return []
+        with self._lock:
+            events = [e for e in self._recent.get(user_id, ()) if e.id > after_id]
+        if not events or events[0].id != after_id + 1:
+            return None
+        return events
+
+    # Удаленный пользователь: его id может достаться новому (SQLite)
+    def forget(self, user_id: int) -> None:
+        with self._lock:
+            self._recent.pop(user_id, None)
+            self._held.pop(user_id, None)
+
+    def connections(self) -> int:
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+broker = EventBroker()
+
+
+# --- Публикация из транзакции ---
+# Событие уходит клиентам только после commit: на PostgreSQL это обеспечивает
+# сам NOTIFY, в остальных случаях события ждут в session.info до after_commit
+def emit(db: Session, event: ChangeEvent) -> None:
+    if EVENTS_PG_NOTIFY and db.get_bind().dialect.name == "postgresql":
+        db.execute(select(func.pg_notify(EVENTS_CHANNEL, event.to_json())))
+    else:
+        db.info.setdefault("pending_events", []).append(event)
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _publish_pending(session: Session) -> None:
+    for event in session.info.pop("pending_events", ()):
+        broker.publish(event)
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _drop_pending(session: Session) -> None:
+    session.info.pop("pending_events", None)
+
+
+# --- LISTEN на PostgreSQL ---
+# Одно соединение asyncpg на воркер; после обрыва переподключается
+async def listen(dsn: str) -> None:
+    import asyncpg
+
+    def on_notify(connection, pid, channel, payload):
+        broker.publish(ChangeEvent.from_json(payload))
+
+    while True:
+        try:
+            connection = await asyncpg.connect(dsn)
+            closed = asyncio.Event()
+            connection.add_termination_listener(lambda _: closed.set())
+            await connection.add_listener(EVENTS_CHANNEL, on_notify)
+            try:
+                await closed.wait()
+            finally:
+                await connection.close()
+        except (OSError, asyncpg.PostgresError) as e:
+            logger.warning("Event listener disconnected: %s", e)
+        await asyncio.sleep(1)
+
+
+# --- Поток SSE ---
+# На одно подключение приходится только очередь и этот генератор: соединение
+# с БД не удерживается, поэтому простаивающих клиентов может быть очень много
+async def sse_stream(
+    subscription: Subscription, last_event_id: Optional[int], current_id: int
+) -> AsyncIterator[str]:
+    try:
+        yield f"retry: {EVENTS_RETRY_MS}\n\n"
+        last_id = current_id
+        if last_event_id is not None:
+            events = broker.replay(subscription.user_id, last_event_id, current_id)
+            if events is None:
+                # Часть событий потеряна: клиент должен перечитать данные
+                yield ChangeEvent(current_id, subscription.user_id, "reset").format()
+            else:
+                for event in events:
+                    yield event.format()
+                last_id = max([last_event_id] + [event.id for event in events])
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    subscription.queue.get(), EVENTS_HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if event is None:
+                return
+            # Событие могло уже прийти из буфера при продолжении
+            if event.id <= last_id:
+                continue
+            yield event.format()
+            last_id = event.id
+    finally:
+        broker.unsubscribe(subscription)
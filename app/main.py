@@ -1,23 +1,92 @@
+import asyncio
+import json
 import os
-from datetime import datetime, timedelta
-from typing import List
-
-from fastapi import Depends, FastAPI, HTTPException, Query, status
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, List, Optional
+
+from fastapi import (
+    BackgroundTasks,
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from pydantic import ValidationError
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+import async_crud
 import auth
 import crud
 import database
+import compression
+import db_metrics
+import etags
+import events
+import hashing
 import models
+import purge
+import ratelimit
+import rollups
 import schemas
-
-# Создаем таблицы в БД (если их еще нет)
-models.Base.metadata.create_all(bind=database.engine)
-
-app = FastAPI(title="Task Tracker API")
+import search
+import selection
+import serialization
+import sessions
+from user_cache import CachedUser, user_cache
+
+# Размер пачки для массовой вставки задач
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", 1000))
+
+
+# Каждый воркер периодически ищет брошенные задания очистки; задание берет
+# в аренду один из них (purge.claim), остальные его пропускают
+async def _resume_purges() -> None:
+    while True:
+        await run_in_threadpool(purge.resume)
+        await asyncio.sleep(purge.USER_PURGE_LEASE_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    listener = None
+    if events.EVENTS_PG_NOTIFY and database.engine.dialect.name == "postgresql":
+        dsn = database.engine.url.set(drivername="postgresql")
+        listener = asyncio.create_task(
+            events.listen(dsn.render_as_string(hide_password=False))
+        )
+    # Очистка аккаунтов, прерванная перезапуском или сбоем
+    resumer = asyncio.create_task(_resume_purges())
+    yield
+    resumer.cancel()
+    if listener is not None:
+        listener.cancel()
+    hashing.hashing_service.shutdown()
+
+
+app = FastAPI(title="Task Tracker API", lifespan=lifespan)
+
+# Подсчет SQL-запросов на каждый HTTP-запрос (Server-Timing, /metrics)
+db_metrics.install(database.engine)
+db_metrics.install(database.get_async_engine().sync_engine)
+app.middleware("http")(db_metrics.query_stats_middleware)
+# Cache-Control и Vary для GET-запросов
+app.middleware("http")(etags.cache_headers_middleware)
+# Сжатие gzip/br/zstd по Accept-Encoding, в том числе потоковых ответов
+app.add_middleware(compression.CompressionMiddleware)
+# Ограничение частоты запросов; подключено последним, чтобы выполняться первым
+app.middleware("http")(ratelimit.rate_limit_middleware)
 
 # --- Эндпоинты ---
 
@@ -26,54 +95,176 @@ app = FastAPI(title="Task Tracker API")
 @app.post(
     "/register", response_model=schemas.UserOut, status_code=status.HTTP_201_CREATED
 )
-def register(user_in: schemas.UserCreate, db: Session = Depends(database.get_db)):
-    user = crud.get_user_by_email(db, user_in.email)
+async def register(user_in: schemas.UserCreate, db: Session = Depends(database.get_db)):
+    user = await run_in_threadpool(crud.get_user_by_email, db, user_in.email)
     if user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_password = auth.get_password_hash(user_in.password)
-    new_user = models.User(email=user_in.email, hashed_password=hashed_password)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    hashed_password = await auth.get_password_hash_async(user_in.password)
+    new_user = await run_in_threadpool(crud.create_user, db, user_in, hashed_password)
+    # id мог остаться в таблице эпох от удаленного пользователя
+    auth.token_epochs.forget(new_user.id)
+    events.broker.forget(new_user.id)
     return new_user
 
 
 # Вход и получение токена
 @app.post("/token", response_model=schemas.Token, status_code=status.HTTP_201_CREATED)
-def login_for_access_token(
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(database.get_db),
 ):
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+    ratelimit.limiter.check_email(form_data.username)
+    user = await auth.authenticate_user_async(
+        db, form_data.username, form_data.password
+    )
     if not user:
+        ratelimit.limiter.record_failure(form_data.username)
         raise HTTPException(status_code=401, detail="Incorrect email or password")
-    access_token = auth.create_access_token(data={"sub": user.email})
-    return {"access_token": access_token, "token_type": "bearer"}
+    access_token = auth.create_user_token(user)
+    refresh_token = await run_in_threadpool(sessions.create, db, user)
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+    }
+
+
+# Новый токен доступа без пароля (и без bcrypt): refresh-токен одноразовый,
+# вместе с токеном доступа выдается следующий
+@app.post("/token/refresh", response_model=schemas.Token)
+def refresh_access_token(
+    body: schemas.RefreshTokenIn, db: Session = Depends(database.get_db)
+):
+    rotated = sessions.rotate(db, body.refresh_token)
+    if rotated is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    user, refresh_token = rotated
+    return {
+        "access_token": auth.create_user_token(user),
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+    }
+
+
+# Выход: refresh-токен и все его преемники больше не действуют
+@app.post("/token/revoke", status_code=status.HTTP_204_NO_CONTENT)
+def revoke_refresh_token(
+    body: schemas.RefreshTokenIn, db: Session = Depends(database.get_db)
+):
+    sessions.revoke(db, body.refresh_token)
 
 
-@app.delete("/delete/me", status_code=status.HTTP_200_OK)
-def delete_user(
+# Небольшой аккаунт удаляется сразу одной командой DELETE. Для аккаунта с
+# числом задач больше USER_PURGE_THRESHOLD ответ 202 приходит сразу, а данные
+# удаляются фоновым заданием пачками; прогресс - GET /purges/{id}
+@app.delete(
+    "/delete/me",
+    status_code=status.HTTP_200_OK,
+    responses={status.HTTP_202_ACCEPTED: {"model": schemas.UserPurgeOut}},
+)
+async def delete_user(
+    background_tasks: BackgroundTasks,
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(database.get_db),
 ):
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+    ratelimit.limiter.check_email(form_data.username)
+    user = await auth.authenticate_user_async(
+        db, form_data.username, form_data.password
+    )
     if not user:
+        ratelimit.limiter.record_failure(form_data.username)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
         )
 
+    large = await run_in_threadpool(
+        crud.has_more_tasks_than, db, user.id, purge.USER_PURGE_THRESHOLD
+    )
+    if large:
+        job = await run_in_threadpool(purge.start, db, user)
+        user_cache.invalidate(user.email)
+        auth.token_epochs.set(user.id, user.token_version)
+        background_tasks.add_task(purge.run, job.id)
+        body = schemas.UserPurgeOut.model_validate(job, from_attributes=True)
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED, content=body.model_dump(mode="json")
+        )
+
     # Удаляем пользователя
-    db.delete(user)
-    db.commit()
+    await run_in_threadpool(crud.delete_user, db, user)
+    user_cache.invalidate(user.email)
+    auth.token_epochs.forget(user.id)
+    events.broker.forget(user.id)
     return None
 
 
-# Получение информации о текущем пользователе
+@app.get("/purges/{purge_id}", response_model=schemas.UserPurgeOut)
+def read_purge(purge_id: str, db: Session = Depends(database.get_db)):
+    job = purge.get(db, purge_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Purge not found")
+    return job
+
+
+# Получение информации о текущем пользователе. ETag зависит только от
+# неизменяемых полей, поэтому 304 отдается без обращения к БД
 @app.get("/users/me", response_model=schemas.UserOut)
-def read_users_me(current_user: models.User = Depends(auth.get_current_user)):
+def read_users_me(
+    request: Request,
+    response: Response,
+    current_user: CachedUser = Depends(auth.get_current_user),
+):
+    etag = etags.weak_etag(current_user.id, current_user.email, current_user.created_at)
+    etags.check_not_modified(request, etag)
+    response.headers["ETag"] = etag
     return current_user
 
 
+# ETag для чтения задач и проектов: версия данных пользователя плюс адрес
+# запроса. Одна выборка по первичному ключу вместо выборки и сериализации списка
+async def user_data_etag(
+    request: Request,
+    db: AsyncSession = Depends(database.get_async_db, scope="function"),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
+) -> str:
+    version = await async_crud.get_data_version(db, current_user.id)
+    etag = etags.weak_etag(
+        current_user.id, version, request.url.path, request.url.query
+    )
+    etags.check_not_modified(request, etag)
+    return etag
+
+
+# --- Лента изменений ---
+
+
+# Server-Sent Events: изменения задач и проектов пользователя. После обрыва
+# клиент передает Last-Event-ID и получает пропущенные события (или reset)
+@app.get("/events", response_class=StreamingResponse)
+async def stream_events(
+    last_event_id: Optional[int] = Header(None),
+    # Соединения обоих пулов возвращаются до начала потока, а не по его окончании
+    db: Session = Depends(database.get_db, scope="function"),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
+):
+    # Подписка до чтения версии, чтобы не пропустить событие между ними
+    subscription = events.broker.subscribe(current_user.id)
+    try:
+        current_id = await run_in_threadpool(crud.get_data_version, db, current_user.id)
+    except BaseException:
+        events.broker.unsubscribe(subscription)
+        raise
+    return StreamingResponse(
+        events.sse_stream(subscription, last_event_id, current_id or 0),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # --- CRUD для задач ---
 
 
@@ -84,30 +275,233 @@ def read_users_me(current_user: models.User = Depends(auth.get_current_user)):
 def create_task(
     task_in: schemas.TaskCreate,
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
 ):
-    task = models.Task(
-        title=task_in.title,
-        description=task_in.description,
-        owner_id=current_user.id,
-        status="pending",
-        created_at=datetime.utcnow(),
-        time_spent=task_in.time_spent,
-    )
-    db.add(task)
-    db.commit()
-    db.refresh(task)
-    return task
+    return crud.create_task(db, task_in, current_user.id)
 
 
-# Получение списка задач текущего пользователя
+# Получение списка задач текущего пользователя (курсорная пагинация или NDJSON-поток)
+# Страница читается через асинхронную сессию, без пула потоков
 @app.get("/tasks/", response_model=List[schemas.TaskOut])
-def read_tasks(
+async def read_tasks(
+    limit: int = Query(100, gt=0, le=1000),
+    cursor: Optional[str] = Query(None, description="Значение X-Next-Cursor"),
+    task_status: Optional[str] = Query(
+        None, alias="status", pattern="^(pending|in_progress|done)$"
+    ),
+    project_id: Optional[int] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    stream: bool = Query(False, description="Отдать все задачи в формате NDJSON"),
+    etag: str = Depends(user_data_etag),
+    # Та же сессия, что у проверки токена: закрывается до начала потока NDJSON
+    db: AsyncSession = Depends(database.get_async_db, scope="function"),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
+):
+    filters = dict(
+        status=task_status,
+        project_id=project_id,
+        created_from=created_from,
+        created_to=created_to,
+    )
+
+    if stream:
+        owner_id = current_user.id
+
+        # Поток живет дольше запроса, поэтому у него собственная сессия
+        def generate_ndjson():
+            stream_db = database.SessionLocal()
+            try:
+                rows = crud.iter_task_rows(stream_db, owner_id, **filters)
+                yield from serialization.ndjson_lines(rows)
+            finally:
+                stream_db.close()
+
+        return StreamingResponse(
+            generate_ndjson(),
+            media_type="application/x-ndjson",
+            headers={"ETag": etag},
+        )
+
+    try:
+        rows, next_cursor = await async_crud.get_task_rows_page(
+            db, current_user.id, limit, cursor, **filters
+        )
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Ответ собирается из строк напрямую; response_model остается для документации
+    response = serialization.ORJSONResponse(
+        serialization.rows_to_dicts(rows), headers={"ETag": etag}
+    )
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+
+# Полнотекстовый поиск по названию и описанию (fuzzy - нечеткий поиск по названию)
+@app.get("/tasks/search", response_model=List[schemas.TaskOut])
+def search_tasks(
+    q: str = Query(..., min_length=1, max_length=200),
+    mode: str = Query("full", pattern="^(full|fuzzy)$"),
+    limit: int = Query(50, gt=0, le=1000),
+    cursor: Optional[str] = Query(None, description="Значение X-Next-Cursor"),
+    etag: str = Depends(user_data_etag),
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
 ):
-    tasks = db.query(models.Task).filter(models.Task.owner_id == current_user.id).all()
-    return tasks
+    try:
+        tasks, next_cursor = search.search_tasks(
+            db, current_user.id, q, mode, limit, cursor
+        )
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    response = serialization.ORJSONResponse(tasks, headers={"ETag": etag})
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+
+# Элементы тела /tasks/bulk: JSON-массив целиком или NDJSON построчно по мере чтения
+async def _iter_bulk_items(request: Request) -> AsyncIterator[object]:
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if buffer.strip():
+            yield buffer
+        return
+
+    try:
+        items = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of tasks")
+    for item in items:
+        yield item
+
+
+def _parse_bulk_item(raw) -> schemas.TaskCreate:
+    if isinstance(raw, bytes):
+        return schemas.TaskCreate.model_validate_json(raw)
+    return schemas.TaskCreate.model_validate(raw)
+
+
+_bulk_item_schema = {
+    "type": "array",
+    "items": {"$ref": "#/components/schemas/TaskCreate"},
+}
+
+
+# Массовое создание задач: вставка пачками по BULK_CHUNK_SIZE строк.
+# atomic - все или ничего, partial - ошибочные элементы пропускаются.
+@app.post(
+    "/tasks/bulk",
+    response_model=schemas.TaskBulkResult,
+    status_code=status.HTTP_201_CREATED,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": _bulk_item_schema},
+                "application/x-ndjson": {
+                    "schema": {"$ref": "#/components/schemas/TaskCreate"}
+                },
+            },
+        }
+    },
+)
+async def create_tasks_bulk(
+    request: Request,
+    mode: str = Query("atomic", pattern="^(atomic|partial)$"),
+    db: Session = Depends(database.get_db),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
+):
+    ids: List[int] = []
+    errors: List[schemas.BulkItemError] = []
+    rows: List[dict] = []
+    positions: List[int] = []
+
+    async def flush():
+        if mode == "atomic":
+            ids.extend(await run_in_threadpool(crud.insert_tasks, db, rows))
+        else:
+            chunk_ids, failures = await run_in_threadpool(
+                crud.insert_tasks_isolated, db, rows
+            )
+            ids.extend(chunk_ids)
+            for position, detail in failures:
+                errors.append(
+                    schemas.BulkItemError(index=positions[position], detail=detail)
+                )
+        rows.clear()
+        positions.clear()
+
+    try:
+        index = 0
+        async for raw in _iter_bulk_items(request):
+            try:
+                task_in = _parse_bulk_item(raw)
+            except ValidationError as e:
+                errors.append(schemas.BulkItemError(index=index, detail=str(e)))
+            else:
+                # В режиме atomic после первой ошибки только собираем остальные ошибки
+                if mode == "partial" or not errors:
+                    rows.append(crud.task_row(task_in, current_user.id))
+                    positions.append(index)
+            index += 1
+            if len(rows) >= BULK_CHUNK_SIZE:
+                await flush()
+        if rows and (mode == "partial" or not errors):
+            await flush()
+    except DBAPIError as e:
+        await run_in_threadpool(db.rollback)
+        raise HTTPException(status_code=422, detail=str(e.orig))
+
+    if mode == "atomic" and errors:
+        await run_in_threadpool(db.rollback)
+        raise HTTPException(
+            status_code=422, detail=[error.model_dump() for error in errors]
+        )
+    if ids:
+        await run_in_threadpool(
+            crud.record_change,
+            db,
+            current_user.id,
+            "tasks.bulk_created",
+            {"count": len(ids)},
+        )
+    await run_in_threadpool(db.commit)
+    return schemas.TaskBulkResult(created=len(ids), ids=ids, errors=errors)
+
+
+# Массовое изменение статуса и проекта задач одним UPDATE
+@app.patch("/tasks/bulk", response_model=schemas.TaskBulkUpdateResult)
+def update_tasks_bulk(
+    changes: schemas.TaskBulkUpdate,
+    db: Session = Depends(database.get_db),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
+):
+    values = changes.model_dump(exclude_unset=True, exclude={"ids"})
+    if not values:
+        raise HTTPException(status_code=400, detail="Nothing to update")
+    project_id = values.get("project_id")
+    if project_id is not None and not crud.get_project(db, project_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Project not found")
+    updated = crud.update_tasks(db, current_user.id, changes.ids, values)
+    if updated:
+        crud.record_change(
+            db,
+            current_user.id,
+            "tasks.bulk_updated",
+            {"count": updated, "changes": values},
+        )
+    db.commit()
+    return {"updated": updated}
 
 
 # Удаление задачи (только владелец)
@@ -115,34 +509,101 @@ def read_tasks(
 def delete_task(
     task_id: int,
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
 ):
-    task = (
-        db.query(models.Task)
-        .filter(models.Task.id == task_id, models.Task.owner_id == current_user.id)
-        .first()
-    )
-    if not task:
+    deleted, project_ids = crud.delete_tasks(db, current_user.id, [task_id])
+    if not deleted:
         raise HTTPException(status_code=404, detail="Task not found")
+    crud.record_change(db, current_user.id, "task.deleted", {"id": task_id})
+    for project_id in project_ids:
+        crud.record_change(db, current_user.id, "project.deleted", {"id": project_id})
+    db.commit()
+    return None
 
-    project_id = task.project_id
 
-    db.delete(task)
+# Массовое удаление задач: DELETE /tasks/?ids=1&ids=2. Отсутствующие и чужие
+# задачи пропускаются; опустевшие проекты удаляются в той же транзакции
+@app.delete("/tasks/", response_model=schemas.TaskBulkDeleteResult)
+def delete_tasks_bulk(
+    ids: List[int] = Query(..., min_length=1, max_length=1000),
+    db: Session = Depends(database.get_db),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
+):
+    deleted, project_ids = crud.delete_tasks(db, current_user.id, ids)
+    if deleted:
+        crud.record_change(
+            db,
+            current_user.id,
+            "tasks.bulk_deleted",
+            # Только счетчики: список id может не влезть в NOTIFY (8000 байт)
+            {"count": len(deleted), "deleted_projects": len(project_ids)},
+        )
     db.commit()
+    return {"deleted": len(deleted), "deleted_project_ids": project_ids}
 
-    if project_id:
-        if (
-            db.query(models.Task).filter(models.Task.project_id == project_id).count()
-            == 0
-        ):
-            project = (
-                db.query(models.Project).filter(models.Project.id == project_id).first()
-            )
-            if project:
-                db.delete(project)
-                db.commit()
 
-    return None
+# --- Учет времени ---
+
+
+def _get_owned_task(db: Session, task_id: int, owner_id: int) -> models.Task:
+    task = crud.get_task(db, task_id, owner_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return task
+
+
+# Запуск таймера по задаче (одновременно может идти только один таймер)
+@app.post(
+    "/tasks/{task_id}/start",
+    response_model=schemas.TimeEntryOut,
+    status_code=status.HTTP_201_CREATED,
+)
+def start_timer(
+    task_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
+):
+    _get_owned_task(db, task_id, current_user.id)
+    try:
+        return crud.start_timer(db, task_id, current_user.id)
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Timer already running"
+        )
+
+
+# Остановка таймера: длительность добавляется к time_spent задачи
+@app.post("/tasks/{task_id}/stop", response_model=schemas.TimeEntryOut)
+def stop_timer(
+    task_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
+):
+    entry = crud.stop_timer(db, task_id, current_user.id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="No running timer for this task")
+    return entry
+
+
+# Текущий запущенный таймер пользователя
+@app.get("/timer/current", response_model=Optional[schemas.TimeEntryOut])
+def read_current_timer(
+    db: Session = Depends(database.get_db),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
+):
+    return crud.get_running_entry(db, current_user.id)
+
+
+# История отрезков времени по задаче
+@app.get("/tasks/{task_id}/time_entries", response_model=List[schemas.TimeEntryOut])
+def read_time_entries(
+    task_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
+):
+    _get_owned_task(db, task_id, current_user.id)
+    return crud.get_time_entries(db, task_id)
 
 
 @app.post(
@@ -151,43 +612,119 @@ def delete_task(
 def create_project(
     project_in: schemas.ProjectCreate,
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
 ):
+    # Проверяем все задачи одним запросом и сообщаем обо всех отсутствующих сразу
+    task_ids = list(dict.fromkeys(project_in.task_ids))
+    owned_ids = crud.lock_owned_task_ids(db, task_ids, current_user.id)
+    missing = [task_id for task_id in task_ids if task_id not in owned_ids]
+    if len(missing) == 1:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Task with id {missing[0]} not found",
+        )
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Tasks with ids {', '.join(map(str, missing))} not found",
+        )
+
+    # Проект и привязка задач в одной транзакции
     try:
-        # 1. Create the project
         db_project = models.Project(name=project_in.name, owner_id=current_user.id)
         db.add(db_project)
+        db.flush()
+        crud.assign_tasks_to_project(db, task_ids, db_project.id)
+        crud.record_change(
+            db,
+            current_user.id,
+            "project.created",
+            {"id": db_project.id, "task_count": len(task_ids)},
+        )
         db.commit()
-        db.refresh(db_project)
-
-        # 2. Associate tasks within a transaction
-        for task_id in project_in.task_ids:
-            task = db.query(models.Task).filter(models.Task.id == task_id).first()
-            if task:
-                task.project_id = db_project.id
-                db.commit()  # Commit within the loop to avoid losing individual task assignments
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Task with id {task_id} not found",
-                )
-        db.refresh(db_project)  # Refresh to get updated task associations
-        return db_project
-
-    except HTTPException as e:
-        db.rollback()
-        db.delete(db_project)
-        db.commit()
-        raise e
-
-    except Exception as e:
+    except IntegrityError:
         db.rollback()
-        if "db_project" in locals():
-            db.delete(db_project)
-        db.commit()
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Project already exists"
         )
+    crud.set_project_tasks(db, db_project, task_ids)
+    return db_project
+
+
+PROJECT_FIELDS = {"id", "name", "tasks"}
+
+
+def _project_fields(fields: Optional[str], include_tasks: bool) -> set:
+    if fields is None:
+        selected = set(PROJECT_FIELDS)
+    else:
+        selected = {field.strip() for field in fields.split(",") if field.strip()}
+        unknown = selected - PROJECT_FIELDS
+        if unknown:
+            raise HTTPException(
+                status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+            )
+    if not include_tasks:
+        selected.discard("tasks")
+    return selected | {"id"}
+
+
+def _project_out(project: models.Project, fields: set) -> dict:
+    data = {"id": project.id}
+    if "name" in fields:
+        data["name"] = project.name
+    if "tasks" in fields:
+        data["tasks"] = project.tasks
+    return data
+
+
+_fields_query = Query(
+    None, description="Поля проекта через запятую: id, name, tasks (sparse fieldset)"
+)
+
+
+# Список проектов пользователя; задачи можно не загружать (include_tasks=false)
+@app.get(
+    "/projects/",
+    response_model=List[schemas.ProjectPartialOut],
+    response_model_exclude_unset=True,
+)
+def read_projects(
+    response: Response,
+    include_tasks: bool = True,
+    fields: Optional[str] = _fields_query,
+    etag: str = Depends(user_data_etag),
+    db: Session = Depends(database.get_db),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
+):
+    response.headers["ETag"] = etag
+    selected = _project_fields(fields, include_tasks)
+    projects = crud.list_projects(db, current_user.id, "tasks" in selected)
+    return [_project_out(project, selected) for project in projects]
+
+
+@app.get(
+    "/projects/{project_id}",
+    response_model=schemas.ProjectPartialOut,
+    response_model_exclude_unset=True,
+)
+def read_project(
+    project_id: int,
+    response: Response,
+    include_tasks: bool = True,
+    fields: Optional[str] = _fields_query,
+    etag: str = Depends(user_data_etag),
+    db: Session = Depends(database.get_db),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
+):
+    response.headers["ETag"] = etag
+    selected = _project_fields(fields, include_tasks)
+    project = crud.get_project_with_tasks(
+        db, project_id, current_user.id, "tasks" in selected
+    )
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return _project_out(project, selected)
 
 
 @app.delete("/projects/{project_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -199,10 +736,9 @@ def delete_project(project_id: int, db: Session = Depends(database.get_db)):
         )
 
     # Обнуляем project_id у связанных задач
-    db.query(models.Task).filter(models.Task.project_id == project_id).update(
-        {"project_id": None}
-    )
+    crud.detach_project_tasks(db, project_id)
     db.delete(project)
+    crud.record_change(db, project.owner_id, "project.deleted", {"id": project_id})
     db.commit()
     return None
 
@@ -212,11 +748,21 @@ def delete_project(project_id: int, db: Session = Depends(database.get_db)):
 )
 def select_tasks_greedy(
     project_id: int,
+    response: Response,
     time_limit: int = Query(
-        ..., gt=0, description="Максимальное доступное время в минутах"
+        ...,
+        gt=0,
+        le=selection.SELECT_TASKS_MAX_TIME_LIMIT,
+        description="Максимальное доступное время в минутах",
+    ),
+    strategy: str = Query(
+        "greedy",
+        pattern="^(greedy|exact|approx)$",
+        description="greedy - самые короткие задачи, exact - максимум занятого "
+        "времени, approx - приближенно для больших проектов",
     ),
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
 ):
     # Проверяем, что проект принадлежит текущему пользователю
     project = (
@@ -230,20 +776,39 @@ def select_tasks_greedy(
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
+    # Жадный подбор считаем в БД; SQLite остается на Python-реализации
+    if strategy == "greedy" and db.get_bind().dialect.name != "sqlite":
+        response.headers["X-Selection-Strategy"] = strategy
+        return crud.select_tasks_running_sum(db, project_id, time_limit)
+
     # Получаем все задачи проекта
     tasks = db.query(models.Task).filter(models.Task.project_id == project_id).all()
 
-    # Сортируем задачи по времени выполнения
-    tasks_sorted = sorted(tasks, key=lambda t: t.time_spent)
+    selected_tasks, used_strategy = selection.select_tasks(tasks, time_limit, strategy)
+    # Если точный подбор не уложился в бюджет CPU, сообщаем о жадном результате
+    response.headers["X-Selection-Strategy"] = used_strategy
+    return selected_tasks
 
-    selected_tasks = []
-    total_time = 0
 
-    for task in tasks_sorted:
-        if total_time + task.time_spent <= time_limit:
-            selected_tasks.append(task)
-            total_time += task.time_spent
-        else:
-            break
+# --- Отчеты ---
 
-    return selected_tasks
+
+# Суммарное время по проектам, статусам или периодам (по дате создания задачи)
+@app.get("/reports/time", response_model=List[schemas.TimeReportRow])
+def time_report(
+    group_by: str = Query("project", pattern="^(project|status|day|week|month)$"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    db: Session = Depends(database.get_db),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
+):
+    return rollups.time_report(db, current_user.id, group_by, date_from, date_to)
+
+
+# --- Служебное ---
+
+
+# Метрики в текстовом формате Prometheus
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def read_metrics():
+    return db_metrics.metrics.render()
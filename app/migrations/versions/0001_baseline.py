@@ -0,0 +1,76 @@
+"""Исходная схема: users, tasks, projects
+
+Базы, созданные раньше через Base.metadata.create_all, уже содержат эту
+схему: для них достаточно выполнить `alembic stamp 0001_baseline`.
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-18 10:00:00
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0001_baseline"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("hashed_password", sa.String(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    op.create_table(
+        "projects",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column(
+            "owner_id",
+            sa.Integer(),
+            sa.ForeignKey("users.id", name="projects_owner_id_fkey"),
+            nullable=False,
+        ),
+    )
+    op.create_index("ix_projects_id", "projects", ["id"])
+    op.create_index("ix_projects_name", "projects", ["name"], unique=True)
+
+    op.create_table(
+        "tasks",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("title", sa.String(), nullable=False),
+        sa.Column("description", sa.String(), nullable=True),
+        sa.Column("status", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("time_spent", sa.Integer(), nullable=False),
+        sa.Column(
+            "owner_id",
+            sa.Integer(),
+            sa.ForeignKey("users.id", name="tasks_owner_id_fkey"),
+            nullable=False,
+        ),
+        sa.Column(
+            "project_id",
+            sa.Integer(),
+            sa.ForeignKey("projects.id", name="tasks_project_id_fkey"),
+            nullable=True,
+        ),
+    )
+    op.create_index("ix_tasks_id", "tasks", ["id"])
+    op.create_index("ix_tasks_title", "tasks", ["title"])
+
+
+def downgrade() -> None:
+    op.drop_table("tasks")
+    op.drop_table("projects")
+    op.drop_table("users")
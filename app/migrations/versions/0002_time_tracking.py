@@ -0,0 +1,89 @@
+"""Версия токенов, агрегаты времени и журнал отрезков времени
+
+Revision ID: 0002_time_tracking
+Revises: 0001_baseline
+Create Date: 2026-10-18 10:10:00
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0002_time_tracking"
+down_revision: Union[str, None] = "0001_baseline"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "users",
+        sa.Column("token_version", sa.Integer(), server_default="0", nullable=False),
+    )
+    op.create_index(
+        "ix_tasks_project_id_time_spent", "tasks", ["project_id", "time_spent"]
+    )
+
+    op.create_table(
+        "task_time_rollups",
+        sa.Column(
+            "owner_id",
+            sa.Integer(),
+            sa.ForeignKey("users.id", name="task_time_rollups_owner_id_fkey"),
+            primary_key=True,
+        ),
+        sa.Column("project_id", sa.Integer(), primary_key=True),
+        sa.Column("status", sa.String(), primary_key=True),
+        sa.Column("day", sa.Date(), primary_key=True),
+        sa.Column("total_time", sa.Integer(), nullable=False),
+        sa.Column("task_count", sa.Integer(), nullable=False),
+    )
+    # Заполняем агрегаты по уже существующим задачам
+    op.execute("""
+        INSERT INTO task_time_rollups
+            (owner_id, project_id, status, day, total_time, task_count)
+        SELECT owner_id, COALESCE(project_id, 0), COALESCE(status, 'pending'),
+               DATE(created_at), SUM(time_spent), COUNT(*)
+        FROM tasks
+        GROUP BY owner_id, COALESCE(project_id, 0), COALESCE(status, 'pending'),
+                 DATE(created_at)
+        """)
+
+    op.create_table(
+        "time_entries",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column(
+            "task_id",
+            sa.Integer(),
+            sa.ForeignKey("tasks.id", name="time_entries_task_id_fkey"),
+            nullable=False,
+        ),
+        sa.Column(
+            "owner_id",
+            sa.Integer(),
+            sa.ForeignKey("users.id", name="time_entries_owner_id_fkey"),
+            nullable=False,
+        ),
+        sa.Column("started_at", sa.DateTime(), nullable=False),
+        sa.Column("stopped_at", sa.DateTime(), nullable=True),
+        sa.Column("duration", sa.Integer(), nullable=True),
+    )
+    op.create_index("ix_time_entries_task_id", "time_entries", ["task_id"])
+    op.create_index(
+        "ix_time_entries_running",
+        "time_entries",
+        ["owner_id"],
+        unique=True,
+        postgresql_where=sa.text("stopped_at IS NULL"),
+        sqlite_where=sa.text("stopped_at IS NULL"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("time_entries")
+    op.drop_table("task_time_rollups")
+    op.drop_index("ix_tasks_project_id_time_spent", table_name="tasks")
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("token_version")
@@ -0,0 +1,36 @@
+"""Индексы под фактические запросы эндпоинтов
+
+- tasks (owner_id, created_at, id): список задач пользователя в порядке
+  курсора, поиск задачи владельца, фильтры read_tasks;
+- projects (owner_id): проекты пользователя;
+- индекс по tasks.title не используется ни одним запросом и только
+  замедляет запись.
+
+Revision ID: 0003_query_indexes
+Revises: 0002_time_tracking
+Create Date: 2026-10-18 10:20:00
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0003_query_indexes"
+down_revision: Union[str, None] = "0002_time_tracking"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_tasks_owner_id_created_at_id", "tasks", ["owner_id", "created_at", "id"]
+    )
+    op.create_index("ix_projects_owner_id", "projects", ["owner_id"])
+    op.drop_index("ix_tasks_title", table_name="tasks")
+
+
+def downgrade() -> None:
+    op.create_index("ix_tasks_title", "tasks", ["title"])
+    op.drop_index("ix_projects_owner_id", table_name="projects")
+    op.drop_index("ix_tasks_owner_id_created_at_id", table_name="tasks")
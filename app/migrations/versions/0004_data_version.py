@@ -0,0 +1,29 @@
+"""Версия данных пользователя для условных GET (ETag)
+
+Revision ID: 0004_data_version
+Revises: 0003_query_indexes
+Create Date: 2026-10-18 12:00:00
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0004_data_version"
+down_revision: Union[str, None] = "0003_query_indexes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "users",
+        sa.Column("data_version", sa.Integer(), server_default="0", nullable=False),
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("data_version")
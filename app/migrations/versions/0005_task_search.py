@@ -0,0 +1,77 @@
+"""Полнотекстовый поиск по задачам
+
+PostgreSQL: GIN-индекс по tsvector названия и описания (выражение совпадает
+с search.TASK_DOCUMENT) и триграммный индекс по названию (pg_trgm).
+SQLite: внешняя FTS5-таблица tasks_fts, синхронизируемая триггерами.
+
+Revision ID: 0005_task_search
+Revises: 0004_data_version
+Create Date: 2026-10-18 14:00:00
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0005_task_search"
+down_revision: Union[str, None] = "0004_data_version"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TASK_DOCUMENT = (
+    "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, ''))"
+)
+
+# Триггеры пересоздаются и после миграций, которые пересобирают таблицу tasks
+SQLITE_FTS_TRIGGERS = (
+    """
+    CREATE TRIGGER tasks_fts_insert AFTER INSERT ON tasks BEGIN
+        INSERT INTO tasks_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER tasks_fts_delete AFTER DELETE ON tasks BEGIN
+        INSERT INTO tasks_fts(tasks_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER tasks_fts_update AFTER UPDATE OF title, description ON tasks
+    BEGIN
+        INSERT INTO tasks_fts(tasks_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO tasks_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+)
+
+
+def upgrade() -> None:
+    if op.get_context().dialect.name == "postgresql":
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute(f"CREATE INDEX ix_tasks_search ON tasks USING gin ({TASK_DOCUMENT})")
+        op.execute(
+            "CREATE INDEX ix_tasks_title_trgm ON tasks USING gin (title gin_trgm_ops)"
+        )
+        return
+    op.execute(
+        "CREATE VIRTUAL TABLE tasks_fts USING fts5("
+        "title, description, content='tasks', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2')"
+    )
+    for trigger in SQLITE_FTS_TRIGGERS:
+        op.execute(trigger)
+    op.execute("INSERT INTO tasks_fts(tasks_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name == "postgresql":
+        op.drop_index("ix_tasks_title_trgm", table_name="tasks")
+        op.drop_index("ix_tasks_search", table_name="tasks")
+        return
+    for name in ("tasks_fts_update", "tasks_fts_delete", "tasks_fts_insert"):
+        op.execute(f"DROP TRIGGER {name}")
+    op.execute("DROP TABLE tasks_fts")
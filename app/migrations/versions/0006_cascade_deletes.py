@@ -0,0 +1,111 @@
+"""Каскадное удаление на стороне БД и фоновая очистка аккаунтов
+
+- внешние ключи на users, tasks и projects получают ON DELETE CASCADE
+  (tasks.project_id - ON DELETE SET NULL), ORM больше не загружает
+  дочерние строки при удалении;
+- индекс time_entries (owner_id) для каскада при удалении пользователя;
+- users.deleted_at: аккаунт удален, данные очищаются фоновым заданием;
+- user_purges: прогресс фоновой очистки.
+
+Revision ID: 0006_cascade_deletes
+Revises: 0005_task_search
+Create Date: 2026-10-18 15:00:00
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0006_cascade_deletes"
+down_revision: Union[str, None] = "0005_task_search"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (таблица, имя ключа, колонка, ссылка, ON DELETE)
+FOREIGN_KEYS = (
+    ("projects", "projects_owner_id_fkey", "owner_id", "users", "CASCADE"),
+    ("tasks", "tasks_owner_id_fkey", "owner_id", "users", "CASCADE"),
+    ("tasks", "tasks_project_id_fkey", "project_id", "projects", "SET NULL"),
+    (
+        "task_time_rollups",
+        "task_time_rollups_owner_id_fkey",
+        "owner_id",
+        "users",
+        "CASCADE",
+    ),
+    ("time_entries", "time_entries_task_id_fkey", "task_id", "tasks", "CASCADE"),
+    ("time_entries", "time_entries_owner_id_fkey", "owner_id", "users", "CASCADE"),
+)
+
+# Копия триггеров из 0005: на SQLite batch пересоздает таблицу tasks, и ее
+# триггеры удаляются вместе со старой таблицей
+SQLITE_FTS_TRIGGERS = (
+    """
+    CREATE TRIGGER tasks_fts_insert AFTER INSERT ON tasks BEGIN
+        INSERT INTO tasks_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER tasks_fts_delete AFTER DELETE ON tasks BEGIN
+        INSERT INTO tasks_fts(tasks_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER tasks_fts_update AFTER UPDATE OF title, description ON tasks
+    BEGIN
+        INSERT INTO tasks_fts(tasks_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO tasks_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+)
+
+
+def _replace_foreign_keys(cascade: bool) -> None:
+    tables = dict.fromkeys(table for table, *_ in FOREIGN_KEYS)
+    for table in tables:
+        with op.batch_alter_table(table) as batch_op:
+            for fk_table, name, column, referent, ondelete in FOREIGN_KEYS:
+                if fk_table != table:
+                    continue
+                batch_op.drop_constraint(name, type_="foreignkey")
+                batch_op.create_foreign_key(
+                    name,
+                    referent,
+                    [column],
+                    ["id"],
+                    ondelete=ondelete if cascade else None,
+                )
+    if op.get_context().dialect.name == "sqlite":
+        for trigger in SQLITE_FTS_TRIGGERS:
+            op.execute(trigger)
+
+
+def upgrade() -> None:
+    _replace_foreign_keys(cascade=True)
+    op.create_index("ix_time_entries_owner_id", "time_entries", ["owner_id"])
+    op.add_column("users", sa.Column("deleted_at", sa.DateTime(), nullable=True))
+    op.create_table(
+        "user_purges",
+        sa.Column("id", sa.String(32), primary_key=True),
+        # Без внешнего ключа: пользователь удаляется в конце задания
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("total_tasks", sa.Integer(), nullable=True),
+        sa.Column("deleted_tasks", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("user_purges")
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("deleted_at")
+    op.drop_index("ix_time_entries_owner_id", table_name="time_entries")
+    _replace_foreign_keys(cascade=False)
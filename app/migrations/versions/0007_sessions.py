@@ -0,0 +1,45 @@
+"""Сессии входа с refresh-токенами
+
+Revision ID: 0007_sessions
+Revises: 0006_cascade_deletes
+Create Date: 2026-10-18 18:00:00
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0007_sessions"
+down_revision: Union[str, None] = "0006_cascade_deletes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sessions",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("family_id", sa.String(32), nullable=False),
+        sa.Column(
+            "user_id",
+            sa.Integer(),
+            sa.ForeignKey("users.id", name="sessions_user_id_fkey", ondelete="CASCADE"),
+            nullable=False,
+        ),
+        sa.Column("token_hash", sa.String(64), nullable=False),
+        sa.Column("token_version", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.Column("used_at", sa.DateTime(), nullable=True),
+        sa.Column("revoked_at", sa.DateTime(), nullable=True),
+    )
+    # Обновление токена - один поиск по этому индексу
+    op.create_index("ix_sessions_token_hash", "sessions", ["token_hash"], unique=True)
+    op.create_index("ix_sessions_family_id", "sessions", ["family_id"])
+    op.create_index("ix_sessions_user_id", "sessions", ["user_id"])
+
+
+def downgrade() -> None:
+    op.drop_table("sessions")
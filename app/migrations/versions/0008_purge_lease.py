@@ -0,0 +1,33 @@
+"""Аренда заданий очистки аккаунтов
+
+Revision ID: 0008_purge_lease
+Revises: 0007_sessions
+Create Date: 2026-10-18 20:00:00
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0008_purge_lease"
+down_revision: Union[str, None] = "0007_sessions"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("user_purges", sa.Column("owner", sa.String(32), nullable=True))
+    op.add_column("user_purges", sa.Column("heartbeat", sa.DateTime(), nullable=True))
+    op.add_column(
+        "user_purges",
+        sa.Column("attempts", sa.Integer(), server_default="0", nullable=False),
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("user_purges") as batch_op:
+        batch_op.drop_column("attempts")
+        batch_op.drop_column("heartbeat")
+        batch_op.drop_column("owner")
@@ -1,6 +1,15 @@
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy import (
+    Column,
+    Date,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    text,
+)
 from sqlalchemy.orm import relationship
 
 from database import Base
@@ -13,10 +22,28 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
-
-    tasks = relationship("Task", back_populates="owner", cascade="all, delete-orphan")
+    # Увеличивается при отзыве всех токенов пользователя
+    token_version = Column(Integer, default=0, server_default="0", nullable=False)
+    # Аккаунт удален, данные очищаются фоновым заданием (purge.py)
+    deleted_at = Column(DateTime, nullable=True)
+    # Увеличивается при любом изменении задач и проектов пользователя (ETag)
+    data_version = Column(Integer, default=0, server_default="0", nullable=False)
+
+    # Дочерние строки удаляет БД (ON DELETE CASCADE), ORM их не загружает
+    tasks = relationship(
+        "Task",
+        back_populates="owner",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
     projects = relationship(
-        "Project", back_populates="owner", cascade="all, delete-orphan"
+        "Project",
+        back_populates="owner",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+    time_rollups = relationship(
+        "TaskTimeRollup", cascade="all, delete-orphan", passive_deletes=True
     )
 
 
@@ -24,17 +51,34 @@ class Task(Base):
     __tablename__ = "tasks"
 
     id = Column(Integer, primary_key=True, index=True)
-    title = Column(String, index=True, nullable=False)
+    title = Column(String, nullable=False)
     description = Column(String, nullable=True)
     status = Column(String, default="pending")  # например: pending, in_progress, done
     created_at = Column(DateTime, default=datetime.utcnow)
     time_spent = Column(Integer, default=0, nullable=False)
 
-    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    project_id = Column(Integer, ForeignKey("projects.id"), nullable=True)
+    owner_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
+    project_id = Column(
+        Integer, ForeignKey("projects.id", ondelete="SET NULL"), nullable=True
+    )
 
     owner = relationship("User", back_populates="tasks")
     project = relationship("Project", back_populates="tasks")
+    time_entries = relationship(
+        "TimeEntry",
+        back_populates="task",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+    __table_args__ = (
+        # Список задач пользователя в порядке курсора (read_tasks)
+        Index("ix_tasks_owner_id_created_at_id", "owner_id", "created_at", "id"),
+        # Подбор задач проекта по времени и проверка пустого проекта
+        Index("ix_tasks_project_id_time_spent", "project_id", "time_spent"),
+    )
 
 
 class Project(Base):
@@ -43,7 +87,92 @@ class Project(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True, nullable=False)
 
-    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    owner_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
     owner = relationship("User", back_populates="projects")
 
-    tasks = relationship("Task", back_populates="project")
+    tasks = relationship("Task", back_populates="project", passive_deletes=True)
+
+    __table_args__ = (Index("ix_projects_owner_id", "owner_id"),)
+
+
+# Предагрегированное время по задачам для отчетов (поддерживается в rollups.py)
+class TaskTimeRollup(Base):
+    __tablename__ = "task_time_rollups"
+
+    owner_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    project_id = Column(Integer, primary_key=True)  # 0 - задачи без проекта
+    status = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    total_time = Column(Integer, default=0, nullable=False)
+    task_count = Column(Integer, default=0, nullable=False)
+
+
+# Журнал отрезков работы над задачей; time_spent задачи - сумма их длительностей
+class TimeEntry(Base):
+    __tablename__ = "time_entries"
+
+    id = Column(Integer, primary_key=True)
+    task_id = Column(
+        Integer, ForeignKey("tasks.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    owner_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    started_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    stopped_at = Column(DateTime, nullable=True)
+    duration = Column(Integer, nullable=True)  # в минутах, после остановки
+
+    task = relationship("Task", back_populates="time_entries")
+
+    __table_args__ = (
+        # Не больше одного запущенного таймера на пользователя; индекс содержит
+        # только запущенные записи, поэтому поиск текущего таймера - O(1)
+        Index(
+            "ix_time_entries_running",
+            "owner_id",
+            unique=True,
+            postgresql_where=text("stopped_at IS NULL"),
+            sqlite_where=text("stopped_at IS NULL"),
+        ),
+    )
+
+
+# Фоновая очистка данных удаленного аккаунта (purge.py)
+class UserPurge(Base):
+    __tablename__ = "user_purges"
+
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    status = Column(String, nullable=False)  # running, done, failed
+    total_tasks = Column(Integer, nullable=True)
+    deleted_tasks = Column(Integer, default=0, server_default="0", nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    # Аренда: задание выполняет воркер owner, пока обновляет heartbeat
+    owner = Column(String(32), nullable=True)
+    heartbeat = Column(DateTime, nullable=True)
+    attempts = Column(Integer, default=0, server_default="0", nullable=False)
+
+
+# Сессия входа: refresh-токен хранится только как HMAC. При обновлении токен
+# помечается использованным и заменяется новым той же семьи (family_id);
+# повторное использование старого токена отзывает всю семью (sessions.py)
+class UserSession(Base):
+    __tablename__ = "sessions"
+
+    id = Column(Integer, primary_key=True)
+    family_id = Column(String(32), nullable=False, index=True)
+    user_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    token_hash = Column(String(64), nullable=False, unique=True, index=True)
+    # Версия токенов пользователя при входе: отзыв токенов закрывает и сессии
+    token_version = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    used_at = Column(DateTime, nullable=True)
+    revoked_at = Column(DateTime, nullable=True)
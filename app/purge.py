@@ -0,0 +1,166 @@
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.orm import Session
+
+import database
+import models
+
+logger = logging.getLogger(__name__)
+
+# --- Конфигурация очистки аккаунтов ---
+# Аккаунты, у которых задач больше порога, очищаются фоновым заданием
+USER_PURGE_THRESHOLD = int(os.getenv("USER_PURGE_THRESHOLD", 10000))
+# Задачи удаляются пачками, каждая в своей короткой транзакции
+USER_PURGE_CHUNK_SIZE = int(os.getenv("USER_PURGE_CHUNK_SIZE", 1000))
+# Задание без heartbeat дольше этого срока считается брошенным и его может
+# продолжить другой воркер; с тем же периодом воркеры ищут такие задания
+USER_PURGE_LEASE_SECONDS = int(os.getenv("USER_PURGE_LEASE_SECONDS", 60))
+# Сколько раз задание запускается, прежде чем остаться в статусе failed
+USER_PURGE_MAX_ATTEMPTS = int(os.getenv("USER_PURGE_MAX_ATTEMPTS", 3))
+
+# Владелец аренды - процесс, а не поток: у каждого воркера свой id
+WORKER_ID = uuid.uuid4().hex
+
+
+# Аккаунт сразу помечается удаленным и теряет токены, данные удаляет run()
+def start(db: Session, user: models.User) -> models.UserPurge:
+    purge = models.UserPurge(id=uuid.uuid4().hex, user_id=user.id, status="running")
+    db.add(purge)
+    user.deleted_at = datetime.utcnow()
+    user.token_version += 1
+    db.commit()
+    return purge
+
+
+# Задание можно взять, если оно не закончено, попытки не исчерпаны и его
+# никто не выполняет (аренды нет или она просрочена)
+def _claimable(now: datetime):
+    return and_(
+        models.UserPurge.status.in_(("running", "failed")),
+        models.UserPurge.attempts < USER_PURGE_MAX_ATTEMPTS,
+        or_(
+            models.UserPurge.owner.is_(None),
+            models.UserPurge.heartbeat
+            < now - timedelta(seconds=USER_PURGE_LEASE_SECONDS),
+        ),
+    )
+
+
+# Условный UPDATE: из нескольких воркеров задание получает один
+def claim(db: Session, purge_id: str) -> bool:
+    now = datetime.utcnow()
+    claimed = db.execute(
+        update(models.UserPurge)
+        .where(models.UserPurge.id == purge_id, _claimable(now))
+        .values(
+            status="running",
+            owner=WORKER_ID,
+            heartbeat=now,
+            attempts=models.UserPurge.attempts + 1,
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return bool(claimed)
+
+
+# Изменение задания от имени владельца аренды; 0 строк - аренду перехватили
+def _update_owned(db: Session, purge_id: str, **values) -> bool:
+    return bool(
+        db.execute(
+            update(models.UserPurge)
+            .where(models.UserPurge.id == purge_id, models.UserPurge.owner == WORKER_ID)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    )
+
+
+def run(purge_id: str) -> None:
+    with database.SessionLocal() as db:
+        if not claim(db, purge_id):
+            return
+        purge = db.get(models.UserPurge, purge_id)
+        owned = models.Task.owner_id == purge.user_id
+        try:
+            if purge.total_tasks is None:
+                purge.total_tasks = db.scalar(
+                    select(func.count()).select_from(models.Task).where(owned)
+                )
+                db.commit()
+            # Короткая пачка еще не значит, что задач не осталось (их мог
+            # удалить другой процесс), поэтому цикл идет до пустой пачки:
+            # удаление пользователя не должно каскадом удалять много строк
+            while True:
+                # Журнал времени задач пачки удаляет БД (ON DELETE CASCADE)
+                chunk = select(models.Task.id).where(owned).limit(USER_PURGE_CHUNK_SIZE)
+                deleted = db.execute(
+                    delete(models.Task)
+                    .where(models.Task.id.in_(chunk.scalar_subquery()))
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                # Счетчик и heartbeat в той же транзакции, что и пачка
+                renewed = _update_owned(
+                    db,
+                    purge_id,
+                    deleted_tasks=models.UserPurge.deleted_tasks + deleted,
+                    heartbeat=datetime.utcnow(),
+                )
+                if not renewed:
+                    db.rollback()
+                    logger.warning("User purge %s was taken over", purge_id)
+                    return
+                db.commit()
+                if not deleted:
+                    break
+            # Проекты и агрегаты небольшие и удаляются каскадом вместе с пользователем
+            db.execute(delete(models.User).where(models.User.id == purge.user_id))
+            finished = _update_owned(
+                db,
+                purge_id,
+                status="done",
+                finished_at=datetime.utcnow(),
+                owner=None,
+            )
+            if not finished:
+                db.rollback()
+                return
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("User purge %s failed", purge_id)
+            # Аренда снимается: задание повторит resume(), пока есть попытки
+            _update_owned(db, purge_id, status="failed", owner=None)
+            db.commit()
+            if purge.attempts >= USER_PURGE_MAX_ATTEMPTS:
+                logger.error(
+                    "User purge %s gave up after %d attempts", purge_id, purge.attempts
+                )
+
+
+# Задания, прерванные перезапуском или сбоем; повторный запуск безопасен
+def unfinished() -> List[str]:
+    with database.SessionLocal() as db:
+        return list(
+            db.scalars(select(models.UserPurge.id).where(_claimable(datetime.utcnow())))
+        )
+
+
+# Вызывается периодически каждым воркером; задание выполнит тот, кто его возьмет
+def resume() -> None:
+    try:
+        purge_ids = unfinished()
+    except Exception:
+        logger.exception("Cannot list unfinished user purges")
+        return
+    for purge_id in purge_ids:
+        run(purge_id)
+
+
+def get(db: Session, purge_id: str) -> models.UserPurge:
+    return db.get(models.UserPurge, purge_id)
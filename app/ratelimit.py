@@ -0,0 +1,183 @@
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from fastapi.responses import JSONResponse
+
+
+# Бюджет в формате "N/S": N запросов за S секунд
+@dataclass(frozen=True)
+class Limit:
+    count: int
+    seconds: float
+
+    @classmethod
+    def parse(cls, value: str) -> "Limit":
+        count, seconds = value.split("/")
+        return cls(int(count), float(seconds))
+
+    @property
+    def rate(self) -> float:
+        return self.count / self.seconds
+
+
+# --- Конфигурация ---
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+# Дешевые запросы: ведро на IP, всплеск до N запросов
+RATE_LIMIT_DEFAULT = Limit.parse(os.getenv("RATE_LIMIT_DEFAULT", "100/1"))
+# Эндпоинты с проверкой пароля (bcrypt): отдельное ведро на IP для каждого
+RATE_LIMIT_AUTH = Limit.parse(os.getenv("RATE_LIMIT_AUTH", "20/60"))
+# Неудачные попытки входа на один email со всех адресов: скользящее окно
+RATE_LIMIT_EMAIL = Limit.parse(os.getenv("RATE_LIMIT_EMAIL", "10/300"))
+# Сколько ключей хранится в памяти (LRU)
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+# Число доверенных прокси перед приложением: адрес клиента - запись
+# X-Forwarded-For, добавленная ближайшим из них (N-я справа); 0 - заголовок
+# не используется. Левые записи присылает сам клиент
+RATE_LIMIT_PROXY_HOPS = int(os.getenv("RATE_LIMIT_PROXY_HOPS", 0))
+
+# Бюджеты по маршрутам; остальные запросы - RATE_LIMIT_DEFAULT
+ROUTE_LIMITS: Dict[Tuple[str, str], Limit] = {
+    ("POST", "/token"): RATE_LIMIT_AUTH,
+    ("POST", "/register"): RATE_LIMIT_AUTH,
+    ("DELETE", "/delete/me"): RATE_LIMIT_AUTH,
+}
+
+
+# --- Интерфейс хранилища ---
+# Для нескольких воркеров можно подключить общее хранилище (например, Redis
+# со скриптом на Lua), реализовав эти методы и передав объект в
+# limiter.set_backend(). Возвращают 0, если запрос разрешен, иначе -
+# через сколько секунд его можно повторить.
+class RateLimitBackend:
+    def take(self, key: str, limit: Limit) -> float:
+        raise NotImplementedError
+
+    # Проверка окна без записи
+    def peek(self, key: str, limit: Limit) -> float:
+        raise NotImplementedError
+
+    def hit(self, key: str, limit: Limit) -> float:
+        raise NotImplementedError
+
+
+# Хранилище в памяти процесса. Вызывается только из event loop и не
+# переключается между чтением и записью, поэтому блокировки не нужны
+class InMemoryBackend(RateLimitBackend):
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._windows: "OrderedDict[str, Deque[float]]" = OrderedDict()
+
+    def _evict(self, entries: OrderedDict) -> None:
+        while len(entries) > self.max_keys:
+            entries.popitem(last=False)
+
+    # Token bucket: ведро на limit.count жетонов пополняется с постоянной скоростью
+    def take(self, key: str, limit: Limit) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (float(limit.count), now))
+        tokens = min(float(limit.count), tokens + (now - updated) * limit.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / limit.rate
+        self._buckets[key] = (tokens - 1, now)
+        self._buckets.move_to_end(key)
+        self._evict(self._buckets)
+        return 0
+
+    # Скользящее окно: не больше limit.count событий за последние limit.seconds
+    def peek(self, key: str, limit: Limit) -> float:
+        window = self._windows.get(key)
+        if window is None:
+            return 0
+        now = time.monotonic()
+        while window and window[0] <= now - limit.seconds:
+            window.popleft()
+        if len(window) >= limit.count:
+            return window[0] + limit.seconds - now
+        return 0
+
+    def hit(self, key: str, limit: Limit) -> float:
+        retry_after = self.peek(key, limit)
+        if retry_after:
+            return retry_after
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = deque(maxlen=limit.count)
+        window.append(time.monotonic())
+        self._windows.move_to_end(key)
+        self._evict(self._windows)
+        return 0
+
+
+class RateLimiter:
+    def __init__(self, backend: RateLimitBackend, enabled: bool = RATE_LIMIT_ENABLED):
+        self.backend = backend
+        self.enabled = enabled
+        self.rejected = 0
+
+    def set_backend(self, backend: RateLimitBackend) -> None:
+        self.backend = backend
+
+    def check_route(self, method: str, path: str, client: str) -> float:
+        if not self.enabled:
+            return 0
+        limit = ROUTE_LIMITS.get((method, path))
+        scope = f"{method} {path}" if limit is not None else "default"
+        retry_after = self.backend.take(
+            f"ip:{scope}:{client}", limit or RATE_LIMIT_DEFAULT
+        )
+        if retry_after:
+            self.rejected += 1
+        return retry_after
+
+    # Перебор паролей одного аккаунта с разных адресов. Считаются только
+    # неудачные попытки (record_failure), иначе любой, кто знает email,
+    # мог бы заблокировать вход владельцу обычными запросами
+    def check_email(self, email: str) -> None:
+        if not self.enabled:
+            return
+        retry_after = self.backend.peek(f"email:{email.lower()}", RATE_LIMIT_EMAIL)
+        if retry_after:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many attempts for this account",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+    def record_failure(self, email: str) -> None:
+        if self.enabled:
+            self.backend.hit(f"email:{email.lower()}", RATE_LIMIT_EMAIL)
+
+
+limiter = RateLimiter(InMemoryBackend())
+
+
+def client_address(request: Request) -> str:
+    if RATE_LIMIT_PROXY_HOPS > 0:
+        forwarded: Optional[str] = request.headers.get("X-Forwarded-For")
+        if forwarded:
+            entries = [entry.strip() for entry in forwarded.split(",")]
+            if len(entries) >= RATE_LIMIT_PROXY_HOPS:
+                return entries[-RATE_LIMIT_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+
+# Middleware: отклоняет запрос до маршрутизации, запросов к БД и bcrypt
+async def rate_limit_middleware(request: Request, call_next):
+    retry_after = limiter.check_route(
+        request.method, request.url.path, client_address(request)
+    )
+    if retry_after:
+        return JSONResponse(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            content={"detail": "Too many requests"},
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+    return await call_next(request)
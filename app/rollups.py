@@ -0,0 +1,191 @@
+from collections import defaultdict
+from datetime import date
+from typing import Iterable, List, Optional
+
+from sqlalchemy import Date, cast, delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import models
+
+# --- Агрегаты времени по задачам ---
+# Таблица task_time_rollups хранит сумму time_spent и число задач по ключу
+# (владелец, проект, статус, день создания). Каждая операция записи над
+# задачами переносит свой вклад: remove_tasks до изменения, add_tasks после.
+# Задачи без проекта хранятся с project_id = 0, чтобы ключ был уникальным.
+
+Rollup = models.TaskTimeRollup
+_KEY = ("owner_id", "project_id", "status", "day")
+
+
+def _task_day(column):
+    return func.date(column, type_=Date)
+
+
+def _upsert(db: Session, rows: List[dict]) -> None:
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = insert(Rollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(_KEY),
+        set_={
+            "total_time": Rollup.total_time + stmt.excluded.total_time,
+            "task_count": Rollup.task_count + stmt.excluded.task_count,
+        },
+    )
+    db.execute(stmt, rows)
+
+
+def _apply(db: Session, groups: Iterable, sign: int) -> None:
+    rows = [
+        {
+            "owner_id": owner_id,
+            "project_id": project_id or 0,
+            "status": task_status,
+            "day": day,
+            "total_time": sign * (total_time or 0),
+            "task_count": sign * task_count,
+        }
+        for owner_id, project_id, task_status, day, total_time, task_count in groups
+    ]
+    _upsert(db, rows)
+    if sign < 0 and rows:
+        owners = {row["owner_id"] for row in rows}
+        db.execute(
+            delete(Rollup).where(Rollup.owner_id.in_(owners), Rollup.task_count <= 0)
+        )
+
+
+# Вклад задач, подходящих под условие, одной агрегирующей выборкой
+def _grouped(db: Session, where) -> List:
+    day = _task_day(models.Task.created_at)
+    stmt = (
+        select(
+            models.Task.owner_id,
+            models.Task.project_id,
+            models.Task.status,
+            day,
+            func.sum(models.Task.time_spent),
+            func.count(),
+        )
+        .where(*where)
+        .group_by(models.Task.owner_id, models.Task.project_id, models.Task.status, day)
+    )
+    return db.execute(stmt).all()
+
+
+def add_tasks(db: Session, *where) -> None:
+    _apply(db, _grouped(db, where), 1)
+
+
+# Строки блокируются до чтения их вклада: иначе два одновременных изменения
+# одних задач вычтут одни и те же старые значения. FOR UPDATE несовместим с
+# GROUP BY, поэтому блокировка - отдельной выборкой. SQLite и так допускает
+# только одну пишущую транзакцию. Порядок по id - против взаимных блокировок
+def remove_tasks(db: Session, *where) -> None:
+    if db.get_bind().dialect.name != "sqlite":
+        lock = select(models.Task.id).where(*where).order_by(models.Task.id)
+        db.execute(lock.with_for_update())
+    _apply(db, _grouped(db, where), -1)
+
+
+# Вклад одной задачи, когда ее поля уже известны (без выборки)
+def _task_group(task, total_time: int, task_count: int) -> tuple:
+    day = task.created_at.date()
+    return (task.owner_id, task.project_id, task.status, day, total_time, task_count)
+
+
+def add_task(db: Session, task) -> None:
+    _apply(db, [_task_group(task, task.time_spent, 1)], 1)
+
+
+def add_task_time(db: Session, task, time_delta: int) -> None:
+    _apply(db, [_task_group(task, time_delta, 0)], 1)
+
+
+# Вклад уже удаленных строк (DELETE ... RETURNING), сгруппированный в памяти
+def remove_rows(db: Session, rows: Iterable) -> None:
+    groups = defaultdict(lambda: [0, 0])
+    for row in rows:
+        group = groups[_task_group(row, 0, 0)[:4]]
+        group[0] += row.time_spent
+        group[1] += 1
+    _apply(db, [key + tuple(totals) for key, totals in groups.items()], -1)
+
+
+# Задачи проекта становятся задачами без проекта: агрегаты переносятся целиком
+def detach_project(db: Session, project_id: int) -> None:
+    groups = db.execute(
+        select(
+            Rollup.owner_id,
+            Rollup.project_id,
+            Rollup.status,
+            Rollup.day,
+            Rollup.total_time,
+            Rollup.task_count,
+        ).where(Rollup.project_id == project_id)
+    ).all()
+    _apply(db, [(group[0], None) + tuple(group[2:]) for group in groups], 1)
+    db.execute(delete(Rollup).where(Rollup.project_id == project_id))
+
+
+# Полный пересчет, например после миграции на существующих данных
+def rebuild(db: Session, owner_id: Optional[int] = None) -> None:
+    where = [] if owner_id is None else [models.Task.owner_id == owner_id]
+    cleanup = delete(Rollup)
+    if owner_id is not None:
+        cleanup = cleanup.where(Rollup.owner_id == owner_id)
+    db.execute(cleanup)
+    add_tasks(db, *where)
+
+
+# --- Отчет ---
+
+
+def _period(db: Session, granularity: str):
+    if granularity == "day":
+        return Rollup.day
+    if db.get_bind().dialect.name == "postgresql":
+        return cast(func.date_trunc(granularity, Rollup.day), Date)
+    if granularity == "week":
+        return func.date(Rollup.day, "weekday 0", "-6 days", type_=Date)
+    return func.date(Rollup.day, "start of month", type_=Date)
+
+
+def time_report(
+    db: Session,
+    owner_id: int,
+    group_by: str,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+) -> List[dict]:
+    if group_by == "project":
+        key = Rollup.project_id
+    elif group_by == "status":
+        key = Rollup.status
+    else:
+        key = _period(db, group_by)
+    stmt = select(
+        key.label("key"),
+        func.sum(Rollup.total_time).label("total_time"),
+        func.sum(Rollup.task_count).label("task_count"),
+    ).where(Rollup.owner_id == owner_id)
+    if date_from is not None:
+        stmt = stmt.where(Rollup.day >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(Rollup.day < date_to)
+    stmt = stmt.group_by(key).order_by(key)
+
+    rows = []
+    for group_key, total_time, task_count in db.execute(stmt):
+        row = {"total_time": total_time, "task_count": task_count}
+        if group_by == "project":
+            row["project_id"] = group_key or None
+        elif group_by == "status":
+            row["status"] = group_key
+        else:
+            row["period"] = group_key
+        rows.append(row)
+    return rows
@@ -1,7 +1,7 @@
-from datetime import datetime
+from datetime import date, datetime
 from typing import List, Optional
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, field_validator
 
 # --- Пользователь ---
 
@@ -22,12 +22,31 @@ class UserOut(UserBase):
         orm_mode = True
 
 
+# Прогресс фоновой очистки удаленного аккаунта
+class UserPurgeOut(BaseModel):
+    id: str
+    status: str
+    total_tasks: Optional[int] = None
+    deleted_tasks: int
+    attempts: int
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+
 # --- Токены ---
 
 
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+
+class RefreshTokenIn(BaseModel):
+    refresh_token: str
 
 
 class TokenData(BaseModel):
@@ -53,6 +72,42 @@ class TaskUpdate(BaseModel):
     status: Optional[str] = Field(None, pattern="^(pending|in_progress|done)$")
 
 
+class TaskBulkUpdate(BaseModel):
+    # Как у DELETE /tasks/: один список IN, блокировка и пересчет агрегатов
+    ids: List[int] = Field(..., min_length=1, max_length=1000)
+    status: Optional[str] = Field(None, pattern="^(pending|in_progress|done)$")
+    project_id: Optional[int] = None
+
+    # Поле можно не передавать, но явный null недопустим: колонка NOT NULL.
+    # project_id = null, наоборот, убирает задачи из проекта
+    @field_validator("status")
+    @classmethod
+    def status_not_null(cls, value):
+        if value is None:
+            raise ValueError("status cannot be null")
+        return value
+
+
+class BulkItemError(BaseModel):
+    index: int
+    detail: str
+
+
+class TaskBulkResult(BaseModel):
+    created: int
+    ids: List[int]
+    errors: List[BulkItemError] = []
+
+
+class TaskBulkUpdateResult(BaseModel):
+    updated: int
+
+
+class TaskBulkDeleteResult(BaseModel):
+    deleted: int
+    deleted_project_ids: List[int] = []
+
+
 class TaskOut(TaskBase):
     id: int
     status: str
@@ -63,6 +118,17 @@ class TaskOut(TaskBase):
         orm_mode = True
 
 
+class TimeEntryOut(BaseModel):
+    id: int
+    task_id: int
+    started_at: datetime
+    stopped_at: Optional[datetime] = None
+    duration: Optional[int] = None
+
+    class Config:
+        orm_mode = True
+
+
 class ProjectBase(BaseModel):
     name: str
 
@@ -80,6 +146,13 @@ class ProjectOut(BaseModel):
         orm_mode = True
 
 
+# Проект с выборочным набором полей (параметр fields)
+class ProjectPartialOut(BaseModel):
+    id: int
+    name: Optional[str] = None
+    tasks: Optional[List[TaskOut]] = None
+
+
 class ProjectAlgOut(BaseModel):
     id: int
     title: str
@@ -88,3 +161,14 @@ class ProjectAlgOut(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+# --- Отчеты ---
+
+
+class TimeReportRow(BaseModel):
+    project_id: Optional[int] = None
+    status: Optional[str] = None
+    period: Optional[date] = None
+    total_time: int
+    task_count: int
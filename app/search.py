@@ -0,0 +1,102 @@
+from typing import List, Optional, Tuple
+
+from sqlalchemy import (
+    Float,
+    and_,
+    column,
+    func,
+    literal,
+    literal_column,
+    or_,
+    select,
+    table,
+)
+from sqlalchemy.orm import Session
+
+import crud
+import models
+
+# --- Полнотекстовый поиск по задачам ---
+# PostgreSQL: tsvector по названию и описанию (GIN-индекс по выражению
+# TASK_DOCUMENT, миграция 0005) и триграммы по названию для нечеткого поиска.
+# SQLite: внешняя FTS5-таблица tasks_fts, которую обновляют триггеры.
+# Ранжирование: чем больше score, тем выше задача; страницы - по (score, id).
+
+# Выражение должно совпадать с индексом ix_tasks_search, иначе индекс не используется
+TASK_DOCUMENT = (
+    "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, ''))"
+)
+
+_fts = table("tasks_fts", column("rowid"))
+
+
+def _pg_match(q: str, mode: str):
+    if mode == "fuzzy":
+        pattern = q.replace("/", "//").replace("%", "/%").replace("_", "/_")
+        score = func.word_similarity(q, models.Task.title, type_=Float)
+        match = or_(
+            models.Task.title.ilike(pattern + "%", escape="/"),
+            literal(q).op("<%")(models.Task.title),
+        )
+        return match, score
+    query = func.websearch_to_tsquery(literal_column("'simple'"), q)
+    document = literal_column(TASK_DOCUMENT)
+    return document.op("@@")(query), func.ts_rank(document, query, type_=Float)
+
+
+# Каждое слово - отдельная фраза в кавычках, чтобы ввод пользователя не
+# разбирался как синтаксис FTS5; в нечетком режиме слова ищутся как префиксы
+def fts5_query(q: str, mode: str) -> Optional[str]:
+    suffix = "*" if mode == "fuzzy" else ""
+    terms = ['"' + term.replace('"', '""') + '"' + suffix for term in q.split()]
+    return " ".join(terms) or None
+
+
+def _sqlite_match(q: str, mode: str):
+    match = literal_column("tasks_fts").op("MATCH")(fts5_query(q, mode))
+    # bm25 тем меньше, чем релевантнее строка
+    return match, -func.bm25(literal_column("tasks_fts"), type_=Float)
+
+
+def search_tasks(
+    db: Session,
+    owner_id: int,
+    q: str,
+    mode: str,
+    limit: int,
+    cursor: Optional[str] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    if db.get_bind().dialect.name == "postgresql":
+        match, score = _pg_match(q, mode)
+        source = select(*crud.TASK_OUT_COLUMNS, score.label("score"))
+    else:
+        if fts5_query(q, mode) is None:
+            return [], None
+        match, score = _sqlite_match(q, mode)
+        source = select(*crud.TASK_OUT_COLUMNS, score.label("score")).join_from(
+            models.Task, _fts, _fts.c.rowid == models.Task.id
+        )
+    # score считается во вложенном запросе: вспомогательные функции FTS5
+    # нельзя использовать в WHERE, а курсору нужно условие по score
+    ranked = source.where(models.Task.owner_id == owner_id, match).subquery()
+    stmt = select(ranked).order_by(ranked.c.score.desc(), ranked.c.id)
+    if cursor is not None:
+        last_score, last_id = crud.unpack_cursor(cursor)
+        stmt = stmt.where(
+            or_(
+                ranked.c.score < float(last_score),
+                and_(ranked.c.score == float(last_score), ranked.c.id > int(last_id)),
+            )
+        )
+    rows = db.execute(stmt.limit(limit + 1)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = crud.pack_cursor([rows[-1].score, rows[-1].id])
+    tasks = []
+    for row in rows:
+        task = row._asdict()
+        del task["score"]
+        tasks.append(task)
+    return tasks, next_cursor
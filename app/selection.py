@@ -0,0 +1,130 @@
+import math
+import os
+import time
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# --- Конфигурация подбора задач ---
+# Лимит процессорного времени на точный/приближенный подбор, затем жадный
+SELECT_TASKS_CPU_BUDGET_MS = int(os.getenv("SELECT_TASKS_CPU_BUDGET_MS", 200))
+# Размер таблицы ДП в приближенном режиме (минуты масштабируются под него)
+SELECT_TASKS_APPROX_RESOLUTION = int(os.getenv("SELECT_TASKS_APPROX_RESOLUTION", 4096))
+# Предел работы ДП (задачи x минуты): проверяется до выделения таблиц, так как
+# одна операция над таблицей на миллионы минут дольше всего бюджета CPU
+SELECT_TASKS_MAX_CELLS = int(os.getenv("SELECT_TASKS_MAX_CELLS", 20_000_000))
+# Верхняя граница time_limit в минутах (год)
+SELECT_TASKS_MAX_TIME_LIMIT = int(os.getenv("SELECT_TASKS_MAX_TIME_LIMIT", 525600))
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class TableTooLarge(BudgetExceeded):
+    pass
+
+
+def _by_time(tasks):
+    return sorted(tasks, key=lambda t: (t.time_spent, t.id))
+
+
+# Самые короткие задачи, пока они помещаются в лимит
+def select_greedy(tasks: Sequence, time_limit: int) -> List:
+    selected = []
+    total_time = 0
+    for task in _by_time(tasks):
+        if total_time + task.time_spent <= time_limit:
+            selected.append(task)
+            total_time += task.time_spent
+        else:
+            break
+    return selected
+
+
+# Задача о рюкзаке 0/1, где ценность равна времени (subset sum).
+# reachable[s] - можно ли набрать ровно s минут; first[s] - задача, на которой
+# сумма s стала достижимой. Так восстановление требует O(capacity) памяти:
+# сумма s - w[first[s]] была достижима на более ранней задаче.
+def _subset_sum(weights: np.ndarray, capacity: int, deadline: float) -> List[int]:
+    if len(weights) * (capacity + 1) > SELECT_TASKS_MAX_CELLS:
+        raise TableTooLarge
+    reachable = np.zeros(capacity + 1, dtype=bool)
+    reachable[0] = True
+    first = np.full(capacity + 1, -1, dtype=np.int32)
+    for i, weight in enumerate(weights):
+        if time.process_time() > deadline:
+            raise BudgetExceeded
+        if weight > capacity:
+            continue
+        newly = reachable[: capacity + 1 - weight] & ~reachable[weight:]
+        reachable[weight:] |= newly
+        first[weight:][newly] = i
+
+    total = int(np.flatnonzero(reachable)[-1])
+    chosen = []
+    while total > 0:
+        i = int(first[total])
+        chosen.append(i)
+        total -= int(weights[i])
+    return chosen
+
+
+def _split(tasks: Sequence, time_limit: int) -> Tuple[List, List, int]:
+    # Задачи без затрат времени берем всегда, остальные решаем ДП
+    free = [t for t in tasks if t.time_spent == 0]
+    rest = [t for t in tasks if 0 < t.time_spent <= time_limit]
+    capacity = min(time_limit, sum(t.time_spent for t in rest))
+    return free, rest, capacity
+
+
+def select_exact(tasks: Sequence, time_limit: int, deadline: float) -> List:
+    free, rest, capacity = _split(tasks, time_limit)
+    if capacity == sum(t.time_spent for t in rest):
+        return _by_time(free + rest)
+    weights = np.fromiter((t.time_spent for t in rest), dtype=np.int64)
+    chosen = _subset_sum(weights, capacity, deadline)
+    return _by_time(free + [rest[i] for i in chosen])
+
+
+# Приближенный режим: минуты округляются вверх до шага scale, поэтому найденный
+# набор всегда помещается в лимит; потеря не больше scale минут на задачу.
+# Шаг выбирается и так, чтобы таблица уложилась в SELECT_TASKS_MAX_CELLS.
+# Оставшееся время добирается жадно.
+def select_approx(tasks: Sequence, time_limit: int, deadline: float) -> List:
+    free, rest, capacity = _split(tasks, time_limit)
+    scale = max(
+        math.ceil(capacity / SELECT_TASKS_APPROX_RESOLUTION),
+        math.ceil(len(rest) * capacity / SELECT_TASKS_MAX_CELLS),
+    )
+    if scale <= 1:
+        return select_exact(tasks, time_limit, deadline)
+    weights = np.fromiter((-(-t.time_spent // scale) for t in rest), dtype=np.int64)
+    chosen = set(_subset_sum(weights, capacity // scale, deadline))
+    selected = [rest[i] for i in chosen]
+    remaining = time_limit - sum(t.time_spent for t in selected)
+    for i, task in sorted(enumerate(rest), key=lambda item: item[1].time_spent):
+        if i not in chosen and task.time_spent <= remaining:
+            selected.append(task)
+            remaining -= task.time_spent
+    return _by_time(free + selected)
+
+
+# Возвращает выбранные задачи и фактически примененную стратегию
+def select_tasks(tasks: Sequence, time_limit: int, strategy: str) -> Tuple[List, str]:
+    if strategy == "greedy":
+        return select_greedy(tasks, time_limit), strategy
+    deadline = time.process_time() + SELECT_TASKS_CPU_BUDGET_MS / 1000
+    solver = select_exact if strategy == "exact" else select_approx
+    try:
+        return solver(tasks, time_limit, deadline), strategy
+    except TableTooLarge:
+        # Точная таблица слишком велика: сразу приближенный подбор
+        if strategy == "exact":
+            try:
+                return select_approx(tasks, time_limit, deadline), "approx"
+            except BudgetExceeded:
+                pass
+    except BudgetExceeded:
+        pass
+    return select_greedy(tasks, time_limit), "greedy"
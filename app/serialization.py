@@ -0,0 +1,25 @@
+from typing import Any, Iterable, Iterator, List
+
+import orjson
+from starlette.responses import Response
+
+# --- Быстрая сериализация списков ---
+# Строки SELECT по колонкам TaskOut сериализуются orjson напрямую, без ORM-объектов
+# и без валидации через Pydantic. Схема OpenAPI по-прежнему берется из
+# response_model эндпоинта, поэтому набор и порядок колонок должны совпадать с TaskOut.
+
+
+class ORJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+
+def rows_to_dicts(rows: Iterable) -> List[dict]:
+    return [row._asdict() for row in rows]
+
+
+def ndjson_lines(rows: Iterable) -> Iterator[bytes]:
+    for row in rows:
+        yield orjson.dumps(row._asdict(), option=orjson.OPT_APPEND_NEWLINE)
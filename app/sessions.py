@@ -0,0 +1,134 @@
+import hashlib
+import hmac
+import os
+import secrets
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import delete, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+import auth
+import models
+
+# --- Конфигурация сессий ---
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 30))
+# Сколько хранится использованный токен: его повтор в этом окне отзывает
+# семью, после - просто не найдется
+REFRESH_TOKEN_REUSE_WINDOW = timedelta(
+    hours=int(os.getenv("REFRESH_TOKEN_REUSE_WINDOW_HOURS", 24))
+)
+# Ключ HMAC для хранения токенов; по умолчанию - ключ подписи JWT
+REFRESH_TOKEN_SECRET = os.getenv("REFRESH_TOKEN_SECRET", auth.SECRET_KEY).encode()
+
+
+# Токен случайный (256 бит), поэтому вместо bcrypt достаточно HMAC:
+# перебор по утекшей таблице невозможен и без медленного хэша
+def hash_token(token: str) -> str:
+    return hmac.new(REFRESH_TOKEN_SECRET, token.encode(), hashlib.sha256).hexdigest()
+
+
+def _issue(db: Session, user: models.User, family_id: str, now: datetime) -> str:
+    token = secrets.token_urlsafe(32)
+    db.execute(
+        insert(models.UserSession).values(
+            family_id=family_id,
+            user_id=user.id,
+            token_hash=hash_token(token),
+            token_version=user.token_version,
+            created_at=now,
+            expires_at=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+        )
+    )
+    return token
+
+
+# Новая сессия при входе по паролю; заодно удаляются истекшие сессии пользователя
+def create(db: Session, user: models.User) -> str:
+    now = datetime.utcnow()
+    db.execute(
+        delete(models.UserSession).where(
+            models.UserSession.user_id == user.id,
+            models.UserSession.expires_at <= now,
+        )
+    )
+    token = _issue(db, user, uuid.uuid4().hex, now)
+    db.commit()
+    return token
+
+
+def _revoke_family(db: Session, family_id: str, now: datetime) -> None:
+    db.execute(
+        update(models.UserSession)
+        .where(
+            models.UserSession.family_id == family_id,
+            models.UserSession.revoked_at.is_(None),
+        )
+        .values(revoked_at=now)
+    )
+    db.commit()
+
+
+# Обмен refresh-токена на новый: (пользователь, новый токен) или None.
+# Старый токен остается в таблице использованным: если он придет еще раз,
+# значит его украли, и вся семья сессии отзывается. Использованные токены
+# старше REFRESH_TOKEN_REUSE_WINDOW и истекшие удаляются, иначе семья
+# растет на строку с каждым обменом
+def rotate(db: Session, token: str) -> Optional[Tuple[models.User, str]]:
+    now = datetime.utcnow()
+    row = db.execute(
+        select(models.UserSession, models.User)
+        .join(models.User, models.User.id == models.UserSession.user_id)
+        .where(models.UserSession.token_hash == hash_token(token))
+    ).first()
+    if row is None:
+        return None
+    session, user = row
+    if session.revoked_at is not None:
+        return None
+    if session.used_at is not None:
+        _revoke_family(db, session.family_id, now)
+        return None
+    if (
+        session.expires_at <= now
+        or user.deleted_at is not None
+        or session.token_version != user.token_version
+    ):
+        return None
+    # Условие на used_at: из двух одновременных обменов проходит один
+    claimed = db.execute(
+        update(models.UserSession)
+        .where(
+            models.UserSession.id == session.id,
+            models.UserSession.used_at.is_(None),
+        )
+        .values(used_at=now)
+    ).rowcount
+    if not claimed:
+        db.rollback()
+        _revoke_family(db, session.family_id, now)
+        return None
+    db.execute(
+        delete(models.UserSession).where(
+            models.UserSession.family_id == session.family_id,
+            or_(
+                models.UserSession.used_at < now - REFRESH_TOKEN_REUSE_WINDOW,
+                models.UserSession.expires_at <= now,
+            ),
+        )
+    )
+    new_token = _issue(db, user, session.family_id, now)
+    db.commit()
+    return user, new_token
+
+
+# Выход: отзывается вся семья, в том числе уже выданный ей новый токен
+def revoke(db: Session, token: str) -> None:
+    family_id = db.scalar(
+        select(models.UserSession.family_id).where(
+            models.UserSession.token_hash == hash_token(token)
+        )
+    )
+    if family_id is not None:
+        _revoke_family(db, family_id, datetime.utcnow())
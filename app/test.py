@@ -1,11 +1,20 @@
 import json
+import os
 
+from alembic import command
+from alembic.config import Config
 from fastapi import status
 from fastapi.testclient import TestClient
 
+import ratelimit
 from main import app  # Замените на путь к вашему экземпляру FastAPI
 
+# Схема тестовой БД создается миграциями, как и в рабочем окружении
+command.upgrade(Config(os.path.join(os.path.dirname(__file__), "alembic.ini")), "head")
+
 client = TestClient(app)
+# Тесты часто входят с одного адреса; ограничение проверяется отдельным тестом
+ratelimit.limiter.enabled = False
 
 # Данные для тестов
 email = "test@test.ru"
@@ -277,6 +286,13 @@ def test_select_tasks_greedy():
     assert selected_tasks[0]["time_spent"] == 10
     assert selected_tasks[1]["time_spent"] == 20
 
+    # Лимит времени ограничен сверху
+    response = client.get(
+        f"/projects/{project_id}/select_tasks?time_limit=60000000&strategy=exact",
+        headers=headers,
+    )
+    assert response.status_code == 422
+
     test_delete()
 
 
@@ -322,3 +338,1236 @@ def test_project_not_found():
     assert "Project not found" in response.json()["detail"]
 
     test_delete()
+
+
+def test_tasks_cursor_pagination():
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+
+    for i in range(5):
+        create_task(i, f"Page task {i}")
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/tasks/", headers=headers, params=params)
+        assert response.status_code == status.HTTP_200_OK
+        page = response.json()
+        assert len(page) <= 2
+        seen.extend(task["id"] for task in page)
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert len(seen) == 5
+    assert seen == sorted(seen)
+
+    response = client.get("/tasks/", headers=headers, params={"cursor": "garbage"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    test_delete()
+
+
+def test_tasks_filters_and_stream():
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+
+    for i in range(3):
+        create_task(i, f"Stream task {i}")
+
+    response = client.get("/tasks/", headers=headers, params={"status": "done"})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == []
+
+    response = client.get("/tasks/", headers=headers, params={"stream": True})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [task["title"] for task in lines] == [f"Stream task {i}" for i in range(3)]
+
+    test_delete()
+
+
+def test_user_cache_hits():
+    from user_cache import user_cache
+
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+
+    client.get("/users/me", headers=headers)
+    before = user_cache.stats()
+    response = client.get("/users/me", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["email"] == email
+    after = user_cache.stats()
+    assert after["hits"] == before["hits"] + 1
+    assert after["misses"] == before["misses"]
+
+    test_delete()
+    response = client.get("/users/me", headers=headers)
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_token_carries_user_id_and_legacy_tokens():
+    import auth
+
+    test_registered_user()
+    test_token()
+
+    payload = auth.jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+    assert payload["sub"] == email
+    assert isinstance(payload["uid"], int)
+
+    response = create_task(5, "Principal task")
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["owner_id"] == payload["uid"]
+
+    legacy_token = auth.create_access_token(data={"sub": email})
+    headers = {"Authorization": f"Bearer {legacy_token}"}
+    response = client.get("/tasks/", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.json()) == 1
+
+    test_delete()
+
+    response = client.get("/tasks/", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_hashing_backpressure():
+    import asyncio
+
+    import hashing
+    from fastapi import HTTPException
+
+    service = hashing.HashingService(workers=0, max_queue=1)
+    hashed = asyncio.run(service.hash(password))
+    assert asyncio.run(service.verify(password, hashed))
+
+    service.pending = 2
+    try:
+        asyncio.run(service.hash(password))
+    except HTTPException as e:
+        assert e.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    else:
+        raise AssertionError("Expected 429 when the hashing queue is full")
+
+
+def test_select_tasks_exact_strategy():
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+
+    task_ids = [
+        create_task(time, f"Knapsack {time}").json()["id"] for time in (10, 20, 25)
+    ]
+    response = client.post(
+        "/projects/", json={"name": "Knapsack", "task_ids": task_ids}, headers=headers
+    )
+    project_id = response.json()["id"]
+
+    url = f"/projects/{project_id}/select_tasks"
+    greedy = client.get(url, headers=headers, params={"time_limit": 45})
+    assert [t["time_spent"] for t in greedy.json()] == [10, 20]
+
+    for strategy in ("exact", "approx"):
+        response = client.get(
+            url, headers=headers, params={"time_limit": 45, "strategy": strategy}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["X-Selection-Strategy"] == strategy
+        assert [t["time_spent"] for t in response.json()] == [20, 25]
+
+    test_delete()
+
+
+def test_selection_solvers():
+    import random
+    from types import SimpleNamespace
+
+    import selection
+
+    rng = random.Random(7)
+    tasks = [SimpleNamespace(id=i, time_spent=rng.randint(1, 500)) for i in range(300)]
+    time_limit = 20000
+
+    exact = selection.select_exact(tasks, time_limit, float("inf"))
+    assert sum(t.time_spent for t in exact) == time_limit
+    assert len({t.id for t in exact}) == len(exact)
+
+    greedy = selection.select_greedy(tasks, time_limit)
+    approx = selection.select_approx(tasks, time_limit, float("inf"))
+    approx_total = sum(t.time_spent for t in approx)
+    assert sum(t.time_spent for t in greedy) <= approx_total <= time_limit
+
+    _, used = selection.select_tasks(tasks, time_limit, "exact")
+    assert used == "exact"
+
+    # Огромный лимит: таблица ДП не выделяется, подбор идет приближенно
+    huge = [
+        SimpleNamespace(id=i, time_spent=minutes)
+        for i, minutes in enumerate((25_000_000, 30_000_000, 40_000_000))
+    ]
+    selected, used = selection.select_tasks(huge, 60_000_000, "exact")
+    assert used == "approx"
+    assert sum(t.time_spent for t in selected) == 55_000_000
+
+
+def test_running_sum_matches_greedy():
+    import crud
+    import database
+    import selection
+
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+
+    task_ids = [
+        create_task(time, f"Window {i}").json()["id"]
+        for i, time in enumerate((30, 5, 5, 0, 12, 40))
+    ]
+    response = client.post(
+        "/projects/", json={"name": "Window", "task_ids": task_ids}, headers=headers
+    )
+    project_id = response.json()["id"]
+
+    with database.SessionLocal() as db:
+        tasks = db.query(crud.models.Task).filter_by(project_id=project_id).all()
+        for time_limit in (1, 10, 22, 52, 1000):
+            rows = crud.select_tasks_running_sum(db, project_id, time_limit)
+            expected = selection.select_greedy(tasks, time_limit)
+            assert [row.id for row in rows] == [task.id for task in expected]
+
+    test_delete()
+
+
+def test_tasks_bulk_create_and_update():
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+
+    items = [{"title": f"Bulk {i}", "time_spent": i} for i in range(5)]
+    response = client.post("/tasks/bulk", json=items, headers=headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["created"] == 5
+    ids = response.json()["ids"]
+
+    broken = items[:2] + [{"title": "No time"}]
+    response = client.post("/tasks/bulk", json=broken, headers=headers)
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["index"] == 2
+    assert len(get_tasks()) == 5
+
+    response = client.post(
+        "/tasks/bulk", params={"mode": "partial"}, json=broken, headers=headers
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["created"] == 2
+    assert [e["index"] for e in response.json()["errors"]] == [2]
+
+    ndjson = "\n".join(json.dumps(item) for item in items[:3])
+    response = client.post(
+        "/tasks/bulk",
+        content=ndjson,
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["created"] == 3
+
+    response = client.patch(
+        "/tasks/bulk", json={"ids": ids, "status": "done"}, headers=headers
+    )
+    assert response.json() == {"updated": 5}
+    done = client.get("/tasks/", params={"status": "done"}, headers=headers).json()
+    assert sorted(task["id"] for task in done) == sorted(ids)
+
+    response = client.patch(
+        "/tasks/bulk", json={"ids": ids, "project_id": 999999}, headers=headers
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    # Явный null для NOT NULL колонки - ошибка валидации, а не 500
+    response = client.patch(
+        "/tasks/bulk", json={"ids": ids, "status": None}, headers=headers
+    )
+    assert response.status_code == 422
+
+    # Слишком длинный список id отклоняется до запроса к БД
+    response = client.patch(
+        "/tasks/bulk",
+        json={"ids": list(range(1, 1002)), "status": "done"},
+        headers=headers,
+    )
+    assert response.status_code == 422
+
+    test_delete()
+
+
+def test_create_project_reports_all_missing_tasks():
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+
+    task_id = create_task(5, "Owned").json()["id"]
+    project_data = {"name": "Missing", "task_ids": [task_id, 999998, 999999]}
+    response = client.post("/projects/", json=project_data, headers=headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json()["detail"] == "Tasks with ids 999998, 999999 not found"
+
+    # Проект не должен создаться частично
+    response = client.post(
+        "/projects/", json={"name": "Missing", "task_ids": [task_id]}, headers=headers
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert [task["id"] for task in response.json()["tasks"]] == [task_id]
+
+    test_delete()
+
+
+def test_time_report_rollups():
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+
+    def report(group_by):
+        response = client.get(
+            "/reports/time", params={"group_by": group_by}, headers=headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        return response.json()
+
+    ids = [create_task(time, f"Report {time}").json()["id"] for time in (10, 20, 30)]
+    items = [{"title": "Bulk report", "time_spent": 5}] * 2
+    client.post("/tasks/bulk", json=items, headers=headers)
+
+    by_status = report("status")
+    assert by_status == [
+        {
+            "project_id": None,
+            "status": "pending",
+            "period": None,
+            "total_time": 70,
+            "task_count": 5,
+        }
+    ]
+    assert report("day")[0]["total_time"] == 70
+    assert report("week")[0]["total_time"] == 70
+    assert report("month")[0]["total_time"] == 70
+
+    response = client.post(
+        "/projects/", json={"name": "Report", "task_ids": ids[:2]}, headers=headers
+    )
+    project_id = response.json()["id"]
+    client.patch(
+        "/tasks/bulk", json={"ids": [ids[2]], "status": "done"}, headers=headers
+    )
+
+    by_project = {row["project_id"]: row["total_time"] for row in report("project")}
+    assert by_project == {None: 40, project_id: 30}
+    by_status = {row["status"]: row["task_count"] for row in report("status")}
+    assert by_status == {"pending": 4, "done": 1}
+
+    client.delete(f"/tasks/{ids[0]}", headers=headers)
+    client.delete(f"/projects/{project_id}", headers=headers)
+    by_project = {row["project_id"]: row["total_time"] for row in report("project")}
+    assert by_project == {None: 60}
+
+    test_delete()
+
+
+def test_time_entries_start_stop():
+    from datetime import datetime, timedelta
+
+    import database
+    import models
+
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+
+    task_id = create_task(5, "Timed").json()["id"]
+    other_id = create_task(0, "Other").json()["id"]
+
+    response = client.post(f"/tasks/{task_id}/start", headers=headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    entry_id = response.json()["id"]
+
+    response = client.post(f"/tasks/{other_id}/start", headers=headers)
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+    response = client.get("/timer/current", headers=headers)
+    assert response.json()["task_id"] == task_id
+
+    with database.SessionLocal() as db:
+        entry = db.get(models.TimeEntry, entry_id)
+        entry.started_at = datetime.utcnow() - timedelta(minutes=10)
+        db.commit()
+
+    response = client.post(f"/tasks/{task_id}/stop", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["duration"] == 10
+
+    response = client.post(f"/tasks/{task_id}/stop", headers=headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert client.get("/timer/current", headers=headers).json() is None
+
+    tasks = {task["id"]: task for task in get_tasks()}
+    assert tasks[task_id]["time_spent"] == 15
+    report = client.get("/reports/time", headers=headers).json()
+    assert report[0]["total_time"] == 15
+
+    history = client.get(f"/tasks/{task_id}/time_entries", headers=headers).json()
+    assert [entry["duration"] for entry in history] == [10]
+
+    test_delete()
+
+
+def explain(sql: str, params=()) -> str:
+    import database
+
+    with database.engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            # На маленьких таблицах планировщик и так выберет seq scan.
+            # SET LOCAL действует до конца транзакции и не попадает в пул
+            trans = conn.begin()
+            try:
+                conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+                rows = conn.exec_driver_sql("EXPLAIN " + sql, params).all()
+            finally:
+                trans.rollback()
+            return "\n".join(row[0] for row in rows)
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, params).all()
+        return "\n".join(row[-1] for row in rows)
+
+
+# Подзапросы и FTS5 (SCAN tasks_fts VIRTUAL TABLE) просматриваются целиком,
+# таблицы схемы - нет. Сортировка в памяти допустима, только если порядок
+# задает вычисленное значение (allow_sort)
+def assert_index_only_plan(plan: str, allow_sort: bool = False):
+    import database
+
+    tables = set(database.Base.metadata.tables)
+    for line in plan.splitlines():
+        line = line.strip()
+        assert "Seq Scan" not in line, plan
+        if line.startswith("SCAN "):
+            assert line.split()[1] not in tables, plan
+        if not allow_sort:
+            assert "TEMP B-TREE" not in line, plan
+
+
+class count_queries:
+    def __init__(self):
+        import database
+
+        # Проверка токена и GET /tasks/ идут через асинхронный движок
+        self.engines = [database.engine, database.get_async_engine().sync_engine]
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        from sqlalchemy import event
+
+        for engine in self.engines:
+            event.listen(engine, "before_cursor_execute", self._record)
+        return self.statements
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+
+        for engine in self.engines:
+            event.remove(engine, "before_cursor_execute", self._record)
+
+
+# Запросы вместе с параметрами, как их выполняет код
+class capture_queries(count_queries):
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            self.statements.append((statement, parameters))
+
+
+def test_query_plans_use_indexes():
+    import crud
+    import database
+    import search
+
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+    user_id = client.get("/users/me", headers=headers).json()["id"]
+    task_ids = [create_task(i, f"Planned task {i}").json()["id"] for i in range(3)]
+    project_id = client.post(
+        "/projects/", json={"name": "Plans", "task_ids": task_ids[:2]}, headers=headers
+    ).json()["id"]
+
+    # Планы строятся для запросов, которые выполняют функции crud и search,
+    # а не для их копий: проверка следует за кодом. Изменения откатываются
+    queries = {
+        "read_tasks": lambda db: crud.get_task_rows_page(db, user_id, 100),
+        "read_tasks?status": lambda db: crud.get_task_rows_page(
+            db, user_id, 100, status="done"
+        ),
+        "task": lambda db: crud.get_task(db, task_ids[0], user_id),
+        "project": lambda db: crud.get_project(db, project_id, user_id),
+        "projects": lambda db: crud.list_projects(db, user_id),
+        "current_timer": lambda db: crud.get_running_entry(db, user_id),
+        "select_tasks_greedy": lambda db: crud.select_tasks_running_sum(
+            db, project_id, 60
+        ),
+        "search": lambda db: search.search_tasks(db, user_id, "Planned", "full", 50),
+        "search?fuzzy": lambda db: search.search_tasks(
+            db, user_id, "Plan", "fuzzy", 50
+        ),
+        "delete_tasks": lambda db: crud.delete_tasks(db, user_id, task_ids),
+    }
+    # Порядок по накопленной сумме и по релевантности известен только после выборки
+    sorted_in_memory = {"select_tasks_greedy", "search", "search?fuzzy"}
+    checked = set()
+    for name, query in queries.items():
+        with database.SessionLocal() as db, capture_queries() as statements:
+            query(db)
+            db.rollback()
+        assert statements, name
+        for sql, params in statements:
+            if sql.lstrip().upper().startswith("INSERT"):
+                continue
+            assert_index_only_plan(explain(sql, params), name in sorted_in_memory)
+            checked.add(sql.split()[0].upper())
+    # Проверены и выборки, и удаление (DELETE ... RETURNING, NOT EXISTS)
+    assert {"SELECT", "DELETE"} <= checked
+
+    test_delete()
+
+
+def test_write_query_counts():
+    with count_queries() as statements:
+        test_registered_user()
+    # Проверка email + INSERT ... RETURNING
+    assert len(statements) == 2, statements
+
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+    client.get("/tasks/", headers=headers)  # прогрев таблицы эпох токенов
+
+    with count_queries() as statements:
+        response = create_task(5, "Counted")
+    assert response.status_code == status.HTTP_201_CREATED
+    # INSERT ... RETURNING + обновление агрегата + версия данных
+    assert len(statements) == 3, statements
+    task_id = response.json()["id"]
+
+    with count_queries() as statements:
+        client.get("/users/me", headers=headers)
+        client.get("/users/me", headers=headers)
+    # Первый запрос читает пользователя, второй берет его из кэша
+    assert len(statements) == 1, statements
+
+    with count_queries() as statements:
+        response = client.post(f"/tasks/{task_id}/start", headers=headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    # Проверка владельца + INSERT
+    assert len(statements) == 2, statements
+
+    with count_queries() as statements:
+        response = client.get("/tasks/", headers=headers)
+    # Версия данных для ETag + страница задач
+    assert len(statements) == 2, statements
+
+    test_delete()
+
+
+def test_query_stats_headers_and_metrics():
+    import db_metrics
+
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+
+    client.get("/tasks/", headers=headers)  # прогрев таблицы эпох токенов
+    response = client.get("/tasks/", headers=headers)
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+    assert 'desc="2 queries"' in response.headers["Server-Timing"]
+
+    metrics = client.get("/metrics").text
+    assert 'db_queries_total{method="GET",route="/tasks/"}' in metrics
+    assert "user_cache_hits_total" in metrics
+
+    stats = db_metrics.RequestStats()
+    stats.queries = db_metrics.N_PLUS_ONE_THRESHOLD
+    stats.shapes["SELECT * FROM tasks WHERE project_id = ?"] = stats.queries
+    db_metrics.QUERY_BUDGET_STRICT = True
+    try:
+        db_metrics.check_budget(stats, "GET /projects/")
+    except db_metrics.QueryBudgetExceeded as e:
+        assert "repeated" in str(e)
+    else:
+        raise AssertionError("Expected the N+1 pattern to be reported")
+    finally:
+        db_metrics.QUERY_BUDGET_STRICT = False
+
+    test_delete()
+
+
+def test_read_projects_eager_and_sparse():
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+
+    for n in range(3):
+        task_ids = [create_task(5, f"P{n} task {i}").json()["id"] for i in range(2)]
+        response = client.post(
+            "/projects/",
+            json={"name": f"Eager {n}", "task_ids": task_ids},
+            headers=headers,
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        assert len(response.json()["tasks"]) == 2
+    client.get("/projects/", headers=headers)  # прогрев таблицы эпох токенов
+
+    with count_queries() as statements:
+        response = client.get("/projects/", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    projects = response.json()
+    assert [len(project["tasks"]) for project in projects] == [2, 2, 2]
+    # Версия данных + проекты + все их задачи одним запросом, без N+1
+    assert len(statements) == 3, statements
+
+    response = client.get(
+        "/projects/", params={"include_tasks": False}, headers=headers
+    )
+    assert all("tasks" not in project for project in response.json())
+
+    project_id = projects[0]["id"]
+    response = client.get(
+        f"/projects/{project_id}", params={"fields": "id"}, headers=headers
+    )
+    assert response.json() == {"id": project_id}
+
+    response = client.get(
+        f"/projects/{project_id}", params={"fields": "name,owner"}, headers=headers
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response = client.get(f"/projects/{project_id}", headers=headers)
+    assert response.json()["tasks"][0]["title"] == "P0 task 0"
+
+    test_delete()
+
+
+def test_tasks_fast_path_matches_task_out():
+    import database
+    import models
+    import schemas
+
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+    for i in range(3):
+        create_task(i, f"Fast task {i}")
+
+    response = client.get("/tasks/", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    fast = response.json()
+
+    # Тот же ответ, что и при валидации ORM-объектов через TaskOut
+    with database.SessionLocal() as db:
+        tasks = db.query(models.Task).filter(
+            models.Task.id.in_([task["id"] for task in fast])
+        )
+        expected = {
+            task.id: schemas.TaskOut.model_validate(
+                task, from_attributes=True
+            ).model_dump(mode="json")
+            for task in tasks
+        }
+    assert fast == [expected[task["id"]] for task in fast]
+
+    # Схема в OpenAPI по-прежнему описывается через TaskOut
+    operation = app.openapi()["paths"]["/tasks/"]["get"]
+    schema = operation["responses"]["200"]["content"]["application/json"]["schema"]
+    assert schema["items"]["$ref"].endswith("/TaskOut")
+
+    test_delete()
+
+
+def test_conditional_get_etag():
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+    create_task(5, "Polled task")
+
+    response = client.get("/tasks/", headers=headers)
+    etag = response.headers["ETag"]
+    assert etag.startswith('W/"')
+
+    with count_queries() as statements:
+        response = client.get("/tasks/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b""
+    # Только версия данных, без выборки задач
+    assert len(statements) == 1, statements
+
+    # Другие параметры - другой ETag
+    response = client.get("/tasks/", headers=headers, params={"status": "done"})
+    assert response.headers["ETag"] != etag
+
+    response = client.get("/projects/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    projects_etag = response.headers["ETag"]
+
+    # Любое изменение задач меняет версию
+    create_task(7, "Another polled task")
+    response = client.get("/tasks/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.json()) == 2
+    response = client.get(
+        "/projects/", headers={**headers, "If-None-Match": projects_etag}
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    response = client.get("/users/me", headers=headers)
+    me_etag = response.headers["ETag"]
+    with count_queries() as statements:
+        response = client.get(
+            "/users/me", headers={**headers, "If-None-Match": f'{me_etag}, W/"x"'}
+        )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert statements == []
+
+    test_delete()
+
+
+def test_change_feed_events():
+    import asyncio
+
+    import crud
+    import database
+    import events
+
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+    user_id = client.get("/users/me", headers=headers).json()["id"]
+
+    first = create_task(5, "Feed task").json()
+    create_task(6, "Second feed task")
+    client.delete(f"/tasks/{first['id']}", headers=headers)
+    with database.SessionLocal() as db:
+        current_id = crud.get_data_version(db, user_id)
+
+    async def read(last_event_id, count):
+        subscription = events.broker.subscribe(user_id)
+        stream = events.sse_stream(subscription, last_event_id, current_id)
+        chunks = [await stream.__anext__() for _ in range(count)]
+        await stream.aclose()
+        return chunks
+
+    # Продолжение после переподключения: все события после Last-Event-ID
+    chunks = asyncio.run(read(current_id - 3, 4))
+    assert chunks[0].startswith("retry:")
+    assert [chunk.split("\n")[1] for chunk in chunks[1:]] == [
+        "event: task.created",
+        "event: task.created",
+        "event: task.deleted",
+    ]
+    assert chunks[1].startswith(f"id: {current_id - 2}\n")
+
+    # Буфер не покрывает пропуск - клиент получает reset
+    chunks = asyncio.run(read(current_id - 1000, 2))
+    assert "event: reset" in chunks[1]
+
+    async def live():
+        subscription = events.broker.subscribe(user_id)
+        stream = events.sse_stream(subscription, None, current_id)
+        await stream.__anext__()
+        await asyncio.to_thread(create_task, 1, "Live task")
+        chunk = await asyncio.wait_for(stream.__anext__(), 5)
+        await stream.aclose()
+        return chunk
+
+    chunk = asyncio.run(live())
+    assert chunk.startswith(f"id: {current_id + 1}\nevent: task.created\n")
+    assert '"title": "Live task"' in chunk
+    assert events.broker.connections() == 0
+
+    assert client.get("/events").status_code == status.HTTP_401_UNAUTHORIZED
+
+    test_delete()
+
+
+def test_events_published_in_order():
+    import asyncio
+
+    import events
+
+    # Без NOTIFY события публикуются после commit из разных потоков, и
+    # событие 3 может прийти раньше 2: подписчик все равно получает 1, 2, 3
+    broker = events.EventBroker()
+
+    async def publish_out_of_order():
+        subscription = broker.subscribe(1)
+        for event_id in (1, 3, 2, 3):
+            broker.publish(events.ChangeEvent(event_id, 1, "task.updated"))
+        await asyncio.sleep(0)
+        received = []
+        while not subscription.queue.empty():
+            received.append(subscription.queue.get_nowait().id)
+        broker.unsubscribe(subscription)
+        return received
+
+    assert asyncio.run(publish_out_of_order()) == [1, 2, 3]
+    # Буфер для продолжения тоже без пропусков, поэтому reset не нужен
+    assert [event.id for event in broker.replay(1, 0, 3)] == [1, 2, 3]
+
+
+# TestClient дочитывает ответ до конца, поэтому поток читается напрямую через
+# ASGI. Возвращает статус и число занятых соединений (sync, async) на первом
+# фрагменте тела; после него клиент отключается
+def stream_first_chunk(path, query_string=b""):
+    import asyncio
+
+    import database
+
+    async def probe():
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query_string,
+            "root_path": "",
+            "headers": [
+                (b"host", b"testserver"),
+                (b"authorization", f"{token_type} {token}".encode()),
+            ],
+            "client": ("testclient", 50000),
+            "server": ("testserver", 80),
+        }
+        requested = False
+        disconnected = asyncio.Event()
+        result = {}
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                result["status"] = message["status"]
+            elif message.get("body") and not disconnected.is_set():
+                result["checked_out"] = (
+                    database.engine.pool.checkedout(),
+                    database.get_async_engine().pool.checkedout(),
+                )
+                disconnected.set()
+
+        await asyncio.wait_for(app(scope, receive, send), 5)
+        return result["status"], result["checked_out"]
+
+    return asyncio.run(probe())
+
+
+def test_streams_release_connections():
+    test_registered_user()
+    test_token()
+    create_task(5, "Streamed task")
+
+    # Открытый поток событий не держит соединения ни одного из пулов
+    status_code, checked_out = stream_first_chunk("/events")
+    assert status_code == status.HTTP_200_OK
+    assert checked_out == (0, 0)
+
+    # Выгрузка NDJSON читает своей синхронной сессией (она может успеть
+    # закрыться до первого фрагмента), асинхронная закрыта до начала потока
+    status_code, checked_out = stream_first_chunk("/tasks/", b"stream=true")
+    assert status_code == status.HTTP_200_OK
+    assert checked_out[1] == 0
+
+    test_delete()
+
+
+def test_tasks_search():
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+
+    titles = [
+        "Написать отчет",
+        "Report for the quarter",
+        "Quarterly report review",
+        "Buy milk",
+    ]
+    for i, title in enumerate(titles):
+        create_task(i, title)
+
+    response = client.get("/tasks/search", headers=headers, params={"q": "report"})
+    assert response.status_code == status.HTTP_200_OK
+    found = response.json()
+    assert {task["title"] for task in found} == set(titles[1:3])
+    assert set(found[0]) == {
+        "id",
+        "title",
+        "description",
+        "time_spent",
+        "status",
+        "created_at",
+        "owner_id",
+    }
+
+    response = client.get("/tasks/search", headers=headers, params={"q": "ОТЧЕТ"})
+    assert [task["title"] for task in response.json()] == ["Написать отчет"]
+
+    response = client.get(
+        "/tasks/search", headers=headers, params={"q": "quart", "mode": "fuzzy"}
+    )
+    assert {task["title"] for task in response.json()} == set(titles[1:3])
+
+    # Синтаксис поиска в запросе пользователя не ломает выборку
+    response = client.get("/tasks/search", headers=headers, params={"q": 'milk" OR *'})
+    assert response.status_code == status.HTTP_200_OK
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"q": "report", "limit": 1}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/tasks/search", headers=headers, params=params)
+        seen.extend(task["id"] for task in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert len(seen) == 2 and len(set(seen)) == 2
+
+    # Индекс следует за изменениями задач
+    client.delete(f"/tasks/{seen[-1]}", headers=headers)
+    response = client.get("/tasks/search", headers=headers, params={"q": "report"})
+    assert len(response.json()) == 1
+
+    test_delete()
+
+
+def test_large_account_purge():
+    import auth
+    import database
+    import models
+    import purge
+
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+    user_id = client.get("/users/me", headers=headers).json()["id"]
+    legacy_headers = {
+        "Authorization": f"Bearer {auth.create_access_token(data={'sub': email})}"
+    }
+    assert client.get("/users/me", headers=legacy_headers).status_code == 200
+
+    task_ids = [create_task(i, f"Purged task {i}").json()["id"] for i in range(5)]
+    client.post(
+        "/projects/", json={"name": "Purged", "task_ids": task_ids[:2]}, headers=headers
+    )
+    client.post(f"/tasks/{task_ids[0]}/start", headers=headers)
+
+    threshold, chunk_size = purge.USER_PURGE_THRESHOLD, purge.USER_PURGE_CHUNK_SIZE
+    purge.USER_PURGE_THRESHOLD, purge.USER_PURGE_CHUNK_SIZE = 3, 2
+    run, started = purge.run, []
+    # Фоновое задание откладывается, чтобы проверить аккаунт во время очистки
+    purge.run = started.append
+    try:
+        data = {"username": email, "password": password}
+        response = client.request("DELETE", "/delete/me", data=data)
+    finally:
+        purge.USER_PURGE_THRESHOLD, purge.USER_PURGE_CHUNK_SIZE = threshold, chunk_size
+        purge.run = run
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.json()["status"] == "running"
+
+    # Пока идет очистка, не действуют ни новые, ни старые токены (без uid)
+    for auth_headers in (headers, legacy_headers):
+        assert client.get("/users/me", headers=auth_headers).status_code == 401
+        response = client.post(
+            "/task/create", json={"title": "Late task"}, headers=auth_headers
+        )
+        assert response.status_code == 401
+
+    # Задание в аренде у живого воркера другие воркеры не берут
+    from datetime import datetime, timedelta
+
+    def lease(owner, heartbeat):
+        with database.SessionLocal() as db:
+            job = db.get(models.UserPurge, started[0])
+            job.owner, job.heartbeat = owner, heartbeat
+            db.commit()
+
+    lease("other-worker", datetime.utcnow())
+    assert started[0] not in purge.unfinished()
+    purge.run(started[0])
+    progress = client.get(f"/purges/{started[0]}").json()
+    assert progress["status"] == "running"
+    assert progress["deleted_tasks"] == progress["attempts"] == 0
+
+    # Просроченная аренда переходит к этому воркеру; сбой снимает аренду,
+    # и задание повторяется, пока не исчерпаны попытки
+    stale = timedelta(seconds=purge.USER_PURGE_LEASE_SECONDS + 1)
+    lease("other-worker", datetime.utcnow() - stale)
+    assert started[0] in purge.unfinished()
+    purge.USER_PURGE_CHUNK_SIZE = "broken"
+    try:
+        purge.resume()
+    finally:
+        purge.USER_PURGE_CHUNK_SIZE = chunk_size
+    progress = client.get(f"/purges/{started[0]}").json()
+    assert progress["status"] == "failed"
+    assert progress["attempts"] == 1
+    assert started[0] in purge.unfinished()
+
+    purge.USER_PURGE_CHUNK_SIZE = 2
+    try:
+        purge.resume()
+    finally:
+        purge.USER_PURGE_CHUNK_SIZE = chunk_size
+    progress = client.get(f"/purges/{started[0]}").json()
+    assert progress["status"] == "done"
+    assert progress["total_tasks"] == progress["deleted_tasks"] == 5
+    assert progress["attempts"] == 2
+    with database.SessionLocal() as db:
+        assert not purge.claim(db, started[0])
+
+    with database.SessionLocal() as db:
+        for model in (
+            models.Task,
+            models.Project,
+            models.TimeEntry,
+            models.TaskTimeRollup,
+        ):
+            assert db.query(model).filter(model.owner_id == user_id).count() == 0
+        assert db.get(models.User, user_id) is None
+
+    assert client.get("/tasks/", headers=headers).status_code == 401
+    assert client.get("/purges/missing").status_code == 404
+
+
+def test_delete_tasks_removes_orphan_projects():
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+
+    task_ids = [create_task(i + 1, f"Deleted task {i}").json()["id"] for i in range(5)]
+    first = client.post(
+        "/projects/",
+        json={"name": "Orphan one", "task_ids": task_ids[:1]},
+        headers=headers,
+    ).json()["id"]
+    second = client.post(
+        "/projects/",
+        json={"name": "Orphan two", "task_ids": task_ids[1:4]},
+        headers=headers,
+    ).json()["id"]
+
+    with count_queries() as statements:
+        response = client.delete(f"/tasks/{task_ids[0]}", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    # Проект удален той же транзакцией, без отдельных COUNT и SELECT
+    assert not any(s.lstrip().upper().startswith("SELECT COUNT") for s in statements)
+    assert len([s for s in statements if s.startswith("DELETE FROM projects")]) == 1
+    assert client.get(f"/projects/{first}", headers=headers).status_code == 404
+
+    response = client.delete(f"/tasks/{task_ids[0]}", headers=headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    # Проект с оставшимися задачами не удаляется
+    response = client.delete("/tasks/", params={"ids": task_ids[1:3]}, headers=headers)
+    assert response.json() == {"deleted": 2, "deleted_project_ids": []}
+    response = client.delete(
+        "/tasks/", params={"ids": [task_ids[3], task_ids[4], 10**9]}, headers=headers
+    )
+    assert response.json() == {"deleted": 2, "deleted_project_ids": [second]}
+    # В событии только счетчики: оно должно помещаться в NOTIFY
+    import events
+
+    user_id = client.get("/users/me", headers=headers).json()["id"]
+    event = events.broker.replay(user_id, 0, 10**9)[-1]
+    assert event.type == "tasks.bulk_deleted"
+    assert event.data == {"count": 2, "deleted_projects": 1}
+
+    assert client.get("/tasks/", headers=headers).json() == []
+    report = client.get("/reports/time", params={"group_by": "status"}, headers=headers)
+    assert report.json() == []
+
+    test_delete()
+
+
+def test_rate_limits():
+    test_registered_user()
+    route_limit = ratelimit.ROUTE_LIMITS[("POST", "/token")]
+    email_limit = ratelimit.RATE_LIMIT_EMAIL
+    proxy_hops = ratelimit.RATE_LIMIT_PROXY_HOPS
+    data = {"username": email, "password": password}
+    ratelimit.limiter.enabled = True
+    try:
+        # Ведро на IP для /token, остальные маршруты считаются отдельно
+        ratelimit.limiter.set_backend(ratelimit.InMemoryBackend())
+        ratelimit.ROUTE_LIMITS[("POST", "/token")] = ratelimit.Limit(2, 60)
+        assert client.post("/token", data=data).status_code == 201
+        assert client.post("/token", data=data).status_code == 201
+        response = client.post("/token", data=data)
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert 0 < int(response.headers["Retry-After"]) <= 30
+        assert "access_token" not in response.json()
+        assert client.get("/metrics").status_code == 200
+
+        # Адрес клиента - запись X-Forwarded-For от доверенного прокси (правая),
+        # подставленные клиентом записи слева не дают обойти лимит
+        ratelimit.limiter.set_backend(ratelimit.InMemoryBackend())
+        ratelimit.ROUTE_LIMITS[("POST", "/token")] = ratelimit.Limit(1, 60)
+        ratelimit.RATE_LIMIT_PROXY_HOPS = 1
+        forwarded = {"X-Forwarded-For": "10.0.0.1, 203.0.113.7"}
+        assert client.post("/token", data=data, headers=forwarded).status_code == 201
+        forwarded = {"X-Forwarded-For": "10.0.0.2, 203.0.113.7"}
+        response = client.post("/token", data=data, headers=forwarded)
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        forwarded = {"X-Forwarded-For": "203.0.113.8"}
+        assert client.post("/token", data=data, headers=forwarded).status_code == 201
+        ratelimit.RATE_LIMIT_PROXY_HOPS = proxy_hops
+
+        # Скользящее окно на email: счетчик общий для всех адресов,
+        # успешные входы не считаются
+        ratelimit.limiter.set_backend(ratelimit.InMemoryBackend())
+        ratelimit.ROUTE_LIMITS[("POST", "/token")] = route_limit
+        ratelimit.RATE_LIMIT_EMAIL = ratelimit.Limit(2, 60)
+        for _ in range(3):
+            assert client.post("/token", data=data).status_code == 201
+        wrong = {"username": email.upper(), "password": "wrong"}
+        assert client.post("/token", data=wrong).status_code == 401
+        assert client.post("/token", data=wrong).status_code == 401
+        response = client.post("/token", data=data)
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert response.json()["detail"] == "Too many attempts for this account"
+        assert int(response.headers["Retry-After"]) == 60
+        assert "rate_limit_rejected_total" in client.get("/metrics").text
+    finally:
+        ratelimit.ROUTE_LIMITS[("POST", "/token")] = route_limit
+        ratelimit.RATE_LIMIT_EMAIL = email_limit
+        ratelimit.RATE_LIMIT_PROXY_HOPS = proxy_hops
+        ratelimit.limiter.set_backend(ratelimit.InMemoryBackend())
+        ratelimit.limiter.enabled = False
+    test_delete()
+
+
+def test_refresh_token_rotation():
+    test_registered_user()
+    data = {"username": email, "password": password}
+    first = client.post("/token", data=data).json()["refresh_token"]
+
+    # Обмен без bcrypt: поиск по индексу, пометка старого токена, очистка
+    # семьи и новый токен
+    response = client.post("/token/refresh", json={"refresh_token": first})
+    assert response.status_code == status.HTTP_200_OK
+    assert 'desc="4 queries"' in response.headers["Server-Timing"]
+    body = response.json()
+    assert body["refresh_token"] != first
+    headers = {"Authorization": f"Bearer {body['access_token']}"}
+    assert client.get("/users/me", headers=headers).json()["email"] == email
+
+    # Повтор использованного токена отзывает всю семью, включая новый токен
+    response = client.post("/token/refresh", json={"refresh_token": first})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    response = client.post(
+        "/token/refresh", json={"refresh_token": body["refresh_token"]}
+    )
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    # Выход
+    second = client.post("/token", data=data).json()["refresh_token"]
+    response = client.post("/token/revoke", json={"refresh_token": second})
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    response = client.post("/token/refresh", json={"refresh_token": second})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    # Использованные токены вне окна повтора удаляются: семья не растет
+    from datetime import timedelta
+
+    import database
+    import models
+    import sessions
+
+    reuse_window = sessions.REFRESH_TOKEN_REUSE_WINDOW
+    sessions.REFRESH_TOKEN_REUSE_WINDOW = timedelta(0)
+    try:
+        token = client.post("/token", data=data).json()["refresh_token"]
+        for _ in range(5):
+            response = client.post("/token/refresh", json={"refresh_token": token})
+            token = response.json()["refresh_token"]
+    finally:
+        sessions.REFRESH_TOKEN_REUSE_WINDOW = reuse_window
+    with database.SessionLocal() as db:
+        session = (
+            db.query(models.UserSession)
+            .filter_by(token_hash=sessions.hash_token(token))
+            .one()
+        )
+        family = db.query(models.UserSession).filter_by(family_id=session.family_id)
+        # Последний использованный токен и действующий
+        assert family.count() == 2
+
+    # Удаление аккаунта удаляет и сессии (ON DELETE CASCADE)
+    third = client.post("/token", data=data).json()["refresh_token"]
+    test_delete()
+    response = client.post("/token/refresh", json={"refresh_token": third})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_compression_and_cache_headers():
+    import compression
+
+    assert compression.negotiate("gzip;q=0.5, br;q=0, zstd;q=0") == "gzip"
+    assert compression.negotiate("identity") is None
+    assert compression.negotiate("*;q=0") is None
+
+    test_registered_user()
+    test_token()
+    headers = {"Authorization": f"{token_type} {token}"}
+    for i in range(30):
+        create_task(i, f"Compressed task {i}")
+
+    # Большой ответ сжимается, тело после распаковки то же самое
+    plain = client.get("/tasks/", headers={**headers, "Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    response = client.get("/tasks/", headers={**headers, "Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert int(response.headers["Content-Length"]) < len(plain.content)
+    assert response.json() == plain.json()
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    assert response.headers["Vary"] == "Authorization, Accept-Encoding"
+
+    # Поток сжимается по мере генерации, без Content-Length
+    response = client.get(
+        "/tasks/?stream=true", headers={**headers, "Accept-Encoding": "gzip"}
+    )
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert len(response.text.splitlines()) == 30
+
+    # Маленький ответ - без сжатия; без ETag ответ не сохраняется в кэше
+    response = client.get("/users/me", headers={**headers, "Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert "Accept-Encoding" in response.headers["Vary"]
+    response = client.get("/timer/current", headers=headers)
+    assert response.headers["Cache-Control"] == "private, no-store"
+
+    test_delete()
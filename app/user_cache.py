@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+# --- Конфигурация кэша пользователей ---
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", 60))
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", 10000))
+
+
+# Минимальный набор полей пользователя, который нужен эндпоинтам
+@dataclass(frozen=True)
+class CachedUser:
+    id: int
+    email: str
+    created_at: datetime
+
+
+# --- Интерфейс хранилища ---
+# Для нескольких воркеров можно подключить общее хранилище (например, Redis),
+# реализовав эти три метода и передав объект в user_cache.set_backend().
+class CacheBackend:
+    def get(self, key: str) -> Optional[CachedUser]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: CachedUser, ttl: float) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+
+# LRU в памяти процесса с истечением записей по времени
+class InMemoryBackend(CacheBackend):
+    def __init__(self, max_size: int = USER_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[float, CachedUser]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedUser]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: CachedUser, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class UserCache:
+    def __init__(self, backend: CacheBackend, ttl: int = USER_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def set_backend(self, backend: CacheBackend) -> None:
+        self.backend = backend
+
+    def get(self, sub: str) -> Optional[CachedUser]:
+        value = self.backend.get(sub) if self.ttl > 0 else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    # Запись не должна пережить сам токен, поэтому TTL ограничен его exp
+    def set(self, sub: str, value: CachedUser, token_exp: Optional[float]) -> None:
+        ttl = float(self.ttl)
+        if token_exp is not None:
+            ttl = min(ttl, token_exp - time.time())
+        if ttl > 0:
+            self.backend.set(sub, value, ttl)
+
+    # Вызывается при удалении пользователя и смене пароля
+    def invalidate(self, sub: str) -> None:
+        self.backend.delete(sub)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+user_cache = UserCache(InMemoryBackend())